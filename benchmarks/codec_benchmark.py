@@ -0,0 +1,119 @@
+"""
+Compares the JSON codecs available to galaxykit on payloads shaped like the
+large listings galaxykit fetches.
+
+    python benchmarks/codec_benchmark.py [--count 20000] [--rounds 5]
+"""
+
+import argparse
+import time
+import uuid
+
+from galaxykit import codec
+
+
+def collection_version(i):
+    """An entry of _ui/v1/collection-versions/."""
+    return {
+        "namespace": f"namespace_{i % 500}",
+        "name": f"collection_{i}",
+        "version": f"1.{i % 10}.{i % 7}",
+        "requires_ansible": ">=2.13",
+        "created_at": "2023-05-23T10:11:12.123456Z",
+        "metadata": {
+            "contents": [
+                {
+                    "name": f"module_{j}",
+                    "description": "Manage things on a remote host, idempotently.",
+                    "content_type": "module",
+                }
+                for j in range(8)
+            ],
+            "dependencies": {"ansible.utils": ">=2.0.0"},
+            "tags": ["tools", "linux", "networking"],
+            "authors": ["Red Hat PEAQE Team"],
+            "license": ["GPL-3.0-or-later"],
+            "description": "A collection generated to exercise the API.",
+            "signatures": [],
+        },
+        "contents": [],
+        "sign_state": "unsigned",
+        "repository_list": ["published", "community"],
+    }
+
+
+def search_entry(i):
+    """An entry of v3/plugin/ansible/search/collection-versions/."""
+    pulp_id = uuid.UUID(int=i)
+    return {
+        "repository": {
+            "name": "published",
+            "pulp_href": f"/api/automation-hub/pulp/api/v3/repositories/ansible/ansible/{pulp_id}/",
+            "pulp_labels": {"pipeline": "approved"},
+            "private": False,
+        },
+        "collection_version": {
+            "namespace": f"namespace_{i % 500}",
+            "name": f"collection_{i}",
+            "version": "1.0.0",
+            "pulp_href": f"/api/automation-hub/pulp/api/v3/content/ansible/collection_versions/{pulp_id}/",
+            "sha256": pulp_id.hex * 2,
+            "tags": [{"name": "tools"}, {"name": "linux"}],
+            "require_ansible": ">=2.13",
+            "description": "A collection generated to exercise the API.",
+        },
+        "namespace_metadata": {
+            "pulp_href": f"/api/automation-hub/pulp/api/v3/content/ansible/namespaces/{pulp_id}/",
+            "name": f"namespace_{i % 500}",
+            "company": "Red Hat",
+            "avatar_url": None,
+        },
+        "is_highest": True,
+        "is_deprecated": False,
+        "is_signed": False,
+    }
+
+
+def listing(make_entry, count):
+    return {
+        "meta": {"count": count},
+        "links": {"first": None, "previous": None, "next": None, "last": None},
+        "data": [make_entry(i) for i in range(count)],
+    }
+
+
+def best_of(rounds, func, arg):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = {
+        "collection-versions": listing(collection_version, args.count),
+        "search": listing(search_entry, args.count),
+    }
+    print(f"default codec: {codec.get_codec().name}")
+    print(f"{'payload':<20} {'codec':<12} {'size MB':>8} {'dumps s':>8} {'loads s':>8}")
+    for payload_name, payload in payloads.items():
+        body = codec.get_codec("json").dumps(payload)
+        for name, backend in sorted(codec.CODECS.items()):
+            dumps = best_of(args.rounds, backend.dumps, payload)
+            loads = best_of(args.rounds, backend.loads, body)
+            print(
+                f"{payload_name:<20} {name:<12} {len(body) / 2**20:>8.1f} "
+                f"{dumps:>8.3f} {loads:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
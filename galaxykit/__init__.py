@@ -1,2 +1,3 @@
 from ._version import __version__
 from .client import GalaxyClient
+from .pool import ClientPool
@@ -0,0 +1,153 @@
+"""
+Circuit breaker failing requests fast while a part of the server is degraded.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint_class, retry_in):
+        self.endpoint_class = endpoint_class
+        self.retry_in = retry_in
+        super().__init__(
+            f"Circuit open for '{endpoint_class}' endpoints, "
+            f"not sending requests for another {retry_in:.1f}s."
+        )
+
+
+def endpoint_class(url):
+    """
+    Groups URLs by the part of the server handling them, so a degraded
+    content app doesn't cut off the task or RBAC endpoints.
+    """
+    path = urlparse(url).path
+    if "/content/" in path or "/artifacts/" in path:
+        return "content"
+    if "/tasks/" in path:
+        return "tasks"
+    if "/pulp/api/" in path:
+        return "pulp"
+    if "/_ui/" in path:
+        return "ui"
+    return "api"
+
+
+class _Circuit:
+    def __init__(self, window):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self.probing = False
+        # tells the probe's outcome from that of requests sent before it
+        self.probe = 0
+
+
+class CircuitBreaker:
+    """
+    Keeps one circuit per endpoint class (see `endpoint_class`).
+
+    A circuit opens once at least `min_requests` of the last `window`
+    requests were made and `failure_threshold` (a ratio) of them failed;
+    connection errors, timeouts and 5xx responses count as failures. While
+    open, requests fail immediately with CircuitOpenError. After
+    `reset_timeout` seconds the circuit is half-open: a single probe request
+    is let through, closing the circuit on success or re-opening it on failure.
+
+    One breaker can be shared by all the clients talking to the same server.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=0.5,
+        window=20,
+        min_requests=10,
+        reset_timeout=30,
+        classify=endpoint_class,
+    ):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.classify = classify
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, key):
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            circuit = self._circuits[key] = _Circuit(self.window)
+        return circuit
+
+    def before_request(self, url):
+        """
+        Returns a token (the endpoint class of the url, and the probe number
+        for a half-open circuit's probe) to be passed to `record` once the
+        request is done. Raises CircuitOpenError if it must not be sent.
+        """
+        key = self.classify(url)
+        with self._lock:
+            circuit = self._circuit(key)
+            if circuit.state == CLOSED:
+                return key, None
+            retry_in = circuit.opened_at + self.reset_timeout - time.monotonic()
+            if circuit.state == OPEN and retry_in <= 0:
+                logger.debug(f"Circuit for '{key}' half-open, probing.")
+                circuit.state = HALF_OPEN
+            if circuit.state == HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                circuit.probe += 1
+                return key, circuit.probe
+            raise CircuitOpenError(key, max(retry_in, 0))
+
+    def record(self, token, success):
+        key, probe = token
+        with self._lock:
+            circuit = self._circuit(key)
+            if circuit.state == HALF_OPEN:
+                if probe is None or probe != circuit.probe:
+                    # a request sent before the circuit opened, its outcome
+                    # says nothing about the server's current health
+                    return
+                circuit.probing = False
+                if success:
+                    logger.debug(f"Circuit for '{key}' closed.")
+                    circuit.state = CLOSED
+                    circuit.outcomes.clear()
+                else:
+                    circuit.state = OPEN
+                    circuit.opened_at = time.monotonic()
+                return
+
+            circuit.outcomes.append(success)
+            if circuit.state != CLOSED or len(circuit.outcomes) < self.min_requests:
+                return
+            failures = circuit.outcomes.count(False)
+            if failures >= self.failure_threshold * len(circuit.outcomes):
+                logger.warning(
+                    f"Circuit for '{key}' opened after {failures} failures "
+                    f"in {len(circuit.outcomes)} requests."
+                )
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+
+    def state(self):
+        """Returns the state of every circuit, keyed by endpoint class."""
+        with self._lock:
+            return {
+                key: {
+                    "state": circuit.state,
+                    "requests": len(circuit.outcomes),
+                    "failures": circuit.outcomes.count(False),
+                }
+                for key, circuit in self._circuits.items()
+            }
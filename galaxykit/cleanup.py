@@ -0,0 +1,248 @@
+"""
+Teardown of everything named with a prefix, `galaxykit cleanup --prefix`.
+
+The objects whose name starts with the prefix are found with filtered
+listings, then deleted tier by tier so that nothing is deleted while
+something else still depends on it:
+
+    collections of the namespaces
+    distributions, containers
+    repositories, namespaces, registries
+    remotes, groups, users
+    roles
+
+The deletes of a tier are sent concurrently, and the tasks they start are
+waited for together before moving on to the next tier.
+"""
+
+from . import codec
+from . import repositories
+from . import utils
+from .concurrency import run_bounded
+from .utils import GalaxyClientError, logger
+
+# kind: (listing url, filter for the prefix, name field)
+LISTINGS = {
+    "distributions": (
+        "pulp/api/v3/distributions/ansible/ansible/",
+        "name__startswith",
+        "name",
+    ),
+    "containers": (
+        "{ee}execution-environments/repositories/",
+        "name__icontains",
+        "name",
+    ),
+    "repositories": (
+        "pulp/api/v3/repositories/ansible/ansible/",
+        "name__startswith",
+        "name",
+    ),
+    "namespaces": ("v3/namespaces/", "keywords", "name"),
+    "registries": (
+        "_ui/v1/execution-environments/registries/",
+        "name__icontains",
+        "name",
+    ),
+    "remotes": ("pulp/api/v3/remotes/ansible/collection/", "name__startswith", "name"),
+    "groups": ("pulp/api/v3/groups/", "name__startswith", "name"),
+    "users": ("_ui/v1/users/", "username__startswith", "username"),
+    "roles": ("pulp/api/v3/roles/", "name__startswith", "name"),
+}
+
+TIERS = (
+    ("collections",),
+    ("distributions", "containers"),
+    ("repositories", "namespaces", "registries"),
+    ("remotes", "groups", "users"),
+    ("roles",),
+)
+
+
+def _delete_url(client, kind, obj):
+    if "pulp_href" in obj:
+        return obj["pulp_href"]
+    if kind == "containers":
+        return (
+            f"{client.ui_ee_endpoint_prefix}execution-environments/repositories/"
+            f"{obj['name']}/"
+        )
+    if kind == "namespaces":
+        return f"_ui/v1/namespaces/{obj['name']}"
+    if kind == "registries":
+        pk = obj.get("id", obj.get("pk"))
+        return f"_ui/v1/execution-environments/registries/{pk}/"
+    if kind == "users":
+        return f"_ui/v1/users/{obj['id']}/"
+    raise ValueError(f"Don't know how to delete {kind}")
+
+
+def _find(client, kind, prefix):
+    url, filter_name, name_field = LISTINGS[kind]
+    url = url.format(ee=client.ui_ee_endpoint_prefix)
+    url = utils.merge_query(url, **{filter_name: prefix, "limit": 100})
+    if url.startswith("pulp/"):
+        url = utils.project_fields(url, fields=["pulp_href", name_field])
+    targets = []
+    for obj in utils.iter_results(client, url):
+        # the filter is only a hint, older servers may ignore it
+        name = obj[name_field]
+        if name.startswith(prefix):
+            targets.append(
+                {"kind": kind, "name": name, "url": _delete_url(client, kind, obj)}
+            )
+    return targets
+
+
+def _find_collections(client, namespace):
+    targets = {}
+    for cv in repositories.iter_search_collection(
+        client, records=True, namespace=namespace, is_highest="true"
+    ):
+        url = (
+            f"v3/plugin/ansible/content/{cv.repository_name}/collections/index/"
+            f"{cv.namespace}/{cv.name}/"
+        )
+        targets[url] = {
+            "kind": "collections",
+            "name": f"{cv.namespace}.{cv.name} in {cv.repository_name}",
+            "url": url,
+        }
+    return list(targets.values())
+
+
+def find(client, prefix, kinds=None, max_workers=8):
+    """
+    Returns the objects named with prefix, keyed by kind, each one as
+    {"kind", "name", "url"}, url being the one to delete it with. The
+    collections looked for are those of the namespaces named with prefix,
+    in every repository.
+    """
+    if not prefix:
+        raise ValueError("A prefix is required, refusing to clean up everything.")
+    kinds = list(kinds or ("collections", *LISTINGS))
+    unknown = set(kinds) - set(LISTINGS) - {"collections"}
+    if unknown:
+        raise ValueError(f"Unknown kinds: {', '.join(sorted(unknown))}")
+
+    listed = [kind for kind in LISTINGS if kind in kinds]
+    if "collections" in kinds and "namespaces" not in listed:
+        listed.append("namespaces")
+    found = {}
+    for kind, targets, error in run_bounded(
+        lambda kind: _find(client, kind, prefix), listed, max_workers
+    ):
+        if error is not None:
+            raise error
+        found[kind] = targets
+
+    if "collections" in kinds:
+        found["collections"] = []
+        names = [target["name"] for target in found["namespaces"]]
+        for namespace, targets, error in run_bounded(
+            lambda name: _find_collections(client, name), names, max_workers
+        ):
+            if error is not None:
+                raise error
+            found["collections"].extend(targets)
+    return {kind: found[kind] for kind in kinds}
+
+
+def _send_delete(client, target):
+    """Sends the delete, returns the href of the task it started, if any."""
+    resp = client.delete(target["url"], parse_json=False)
+    if resp.status_code == 202 and resp.content:
+        body = codec.loads(resp.content)
+        if isinstance(body, dict):
+            return body.get("task")
+    return None
+
+
+def delete(client, found, max_workers=8, timeout=3600, on_progress=None):
+    """
+    Deletes the objects returned by find(), tier by tier. Objects already
+    gone are skipped. A failure doesn't stop the teardown: later tiers are
+    still attempted, the objects depending on the failed ones failing in
+    turn. `on_progress(entry)` is called as each object is dealt with.
+
+    Returns a report with one entry per object:
+    {"kind", "name", "url", "status", "error"}, status being deleted,
+    missing or failed.
+    """
+    report = []
+
+    def finish(entry, status, error=None):
+        entry["status"] = status
+        entry["error"] = error
+        if error is None:
+            logger.info(f"Deleted {entry['kind']} {entry['name']}")
+        else:
+            logger.warning(f"Failed to delete {entry['kind']} {entry['name']}: {error}")
+        if on_progress is not None:
+            on_progress(entry)
+
+    for tier in TIERS:
+        entries = [
+            dict(target, status=None, error=None)
+            for kind in tier
+            for target in found.get(kind, ())
+        ]
+        report.extend(entries)
+        by_task = {}
+
+        def sent(entry, task, error):
+            if error is None:
+                if task:
+                    by_task[task] = entry
+                else:
+                    finish(entry, "deleted")
+            elif isinstance(error, GalaxyClientError) and error.status_code == 404:
+                finish(entry, "missing")
+            else:
+                finish(entry, "failed", str(error))
+
+        def finished(task):
+            entry = by_task[task["pulp_href"]]
+            if task["state"] == "completed":
+                finish(entry, "deleted")
+            else:
+                finish(entry, "failed", str(task["error"] or task["state"]))
+
+        run_bounded(
+            lambda entry: _send_delete(client, entry),
+            entries,
+            max_workers,
+            on_done=sent,
+        )
+        utils.wait_for_tasks(client, by_task, timeout=timeout, on_finished=finished)
+    return report
+
+
+def orphan_cleanup(client, timeout=3600):
+    """
+    Deletes the content and artifacts no repository version refers to
+    anymore, and waits for it. Returns the task.
+    """
+    resp = client.post("pulp/api/v3/orphans/cleanup/", {"orphan_protection_time": 0})
+    return utils.wait_for_task(client, resp, timeout=timeout, raise_on_error=True)
+
+
+def cleanup(client, prefix, kinds=None, max_workers=8, orphans=False, dry_run=False):
+    """
+    Deletes every object named with prefix, see find() and delete(). With
+    orphans=True, the orphaned content is cleaned up at the end. With
+    dry_run=True, nothing is deleted and the objects found are reported
+    with a None status.
+    """
+    found = find(client, prefix, kinds, max_workers)
+    if dry_run:
+        return [
+            dict(target, status=None, error=None)
+            for tier in TIERS
+            for kind in tier
+            for target in found.get(kind, ())
+        ]
+    report = delete(client, found, max_workers)
+    if orphans:
+        orphan_cleanup(client)
+    return report
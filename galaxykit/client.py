@@ -2,21 +2,31 @@
 client.py contains the wrapping interface for all the other modules (aside from cli.py)
 """
 
+import copy
+import http.cookiejar
 import json
 import logging
 import platform
 import sys
+import threading
 import time
 from urllib.parse import urlparse, urljoin
 from simplejson.errors import JSONDecodeError
-from simplejson import dumps
 from packaging.version import parse as parse_version
 
 import requests
 
 from .github_social_auth_client import GitHubSocialAuthClient
 from .gw_auth_client import GatewayAuthClient
-from .utils import GalaxyClientError
+from . import codec
+from . import streaming
+from .concurrency import SingleFlight
+from .utils import (
+    GalaxyClientError,
+    project_fields,
+    request_timeout,
+    sleep_within_deadline,
+)
 from . import containers
 from . import containerutils
 from . import groups
@@ -25,10 +35,21 @@ from . import namespaces
 from . import collections
 from . import roles
 from . import __version__ as VERSION
-from .constants import RBAC_VERSION, EE_ENDPOINTS_CHANGE_VERSION, SLEEP_SECONDS_ONETIME
+from .constants import (
+    RBAC_VERSION,
+    EE_ENDPOINTS_CHANGE_VERSION,
+    SLEEP_SECONDS_ONETIME,
+    CONNECT_TIMEOUT_SECONDS,
+    READ_TIMEOUT_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
+# outcomes of GalaxyClient._classify_error
+_ERROR = "error"
+_JWT_EXPIRED = "jwt_expired"
+_SESSION_EXPIRED = "session_expired"
+
 
 def user_agent():
     """Returns a user agent used by ansible-galaxy to include the Ansible version,
@@ -44,13 +65,53 @@ def user_agent():
     )
 
 
+class _RejectAllCookies(http.cookiejar.DefaultCookiePolicy):
+    """Cookie policy that never stores nor sends cookies."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def build_session(pool_maxsize=10):
+    """
+    Returns a requests.Session suitable for sharing between several
+    GalaxyClient instances. Cookies are never persisted on the session, so
+    authentication stays entirely in each client's own headers.
+    """
+    session = requests.Session()
+    session.cookies.set_policy(_RejectAllCookies())
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_maxsize, pool_maxsize=pool_maxsize
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def send_request_with_retry_if_504(
-    method, url, headers, verify, retries=3, *args, **kwargs
+    method, url, headers, verify, retries=3, *args, session=None, **kwargs
 ):
+    request = session.request if session is not None else requests.request
+    timeout = kwargs.pop("timeout", None)
+    what = f"{method.upper()} {url}"
     for _ in range(retries):
-        resp = requests.request(
-            method, url, headers=headers, verify=verify, *args, **kwargs
-        )
+        try:
+            resp = request(
+                method,
+                url,
+                headers=headers,
+                verify=verify,
+                timeout=request_timeout(timeout, what),
+                *args,
+                **kwargs,
+            )
+        except requests.Timeout:
+            # turn a timeout shortened by the deadline into DeadlineExceeded
+            request_timeout(timeout, what)
+            raise
         if resp.status_code == 504:
             logger.debug("504 Gateway timeout. Retrying.")
         else:
@@ -62,6 +123,13 @@ class GalaxyClient:
     """
     The primary class for the client - this is the authenticated context from
     which all authentication flows.
+
+    A client can be shared between threads. Every request is sent with its own
+    snapshot of the auth headers, and expired credentials (JWT token or
+    gateway session) are refreshed by a single thread while the others wait
+    and then retry with the new credentials. Pass `thread_safe=True` to also
+    track the last response per thread, so `client.response` always refers
+    to the calling thread's own last request.
     """
 
     headers = None
@@ -77,10 +145,20 @@ class GalaxyClient:
     _server_version = None
     _container_client = None
     _ui_ee_endpoint_prefix = None
+    _capabilities = None
+    session = None
     gw_auth = None
     gw_root_url = None
     gw_client = None
-    response = None
+    _response = None
+    _local = None
+    _auth_lock = None
+    _auth_generation = 0
+    _singleflight = None
+    hedge_policy = None
+    circuit_breaker = None
+    retain_response = True
+    timeout = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
 
     # expiration tracking for the gateway session cookie
     session_expires = None
@@ -97,8 +175,52 @@ class GalaxyClient:
         github_social_auth=False,
         gw_auth=False,
         gw_root_url=None,
+        session=None,
+        capabilities=None,
+        thread_safe=False,
+        coalesce_gets=False,
+        hedge_policy=None,
+        circuit_breaker=None,
+        timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+        retain_response=True,
     ):
+        """
+        `session` is an optional requests.Session used for every request, and
+        `capabilities` an optional dict caching server facts (version, RBAC
+        support, ...). Both can be shared between clients of the same server,
+        see `galaxykit.pool.ClientPool`.
+
+        With `coalesce_gets=True`, identical GET requests made concurrently
+        from several threads (same URL, same credentials) share a single
+        network request. Every caller still gets its own copy of the result.
+
+        `hedge_policy` is an optional `galaxykit.hedging.HedgePolicy` applied
+        to the GET requests made with `hedge=True`, and `circuit_breaker` an
+        optional `galaxykit.breaker.CircuitBreaker` checked before every
+        request.
+
+        `timeout` is the `requests` timeout, a (connect, read) tuple by
+        default, applied to every request unless a call passes its own.
+        Requests made within a `galaxykit.utils.deadline()` block are also
+        bounded by the deadline.
+
+        With `retain_response=False` the client doesn't keep the last
+        response around as `client.response`, which otherwise holds on to
+        its (possibly large) body until the next request.
+        """
+        self._auth_lock = threading.RLock()
+        if thread_safe:
+            self._local = threading.local()
+        if coalesce_gets:
+            # the results are plain dicts callers commonly modify and send back
+            self._singleflight = SingleFlight(copy=copy.deepcopy)
+        self.hedge_policy = hedge_policy
+        self.circuit_breaker = circuit_breaker
+        self.timeout = timeout
+        self.retain_response = retain_response
         self.galaxy_root = galaxy_root
+        self.session = session
+        self._capabilities = {} if capabilities is None else capabilities
         self.headers = {}
         self.token = None
         self.https_verify = https_verify
@@ -179,26 +301,50 @@ class GalaxyClient:
                 self.gw_root_url.rstrip("/") + "/", "/api/galaxy/"
             )
 
+    def _gateway_session_valid(self):
+        if self.session_expires is None:
+            return False
+        return int(time.time()) < (self.session_expires - 10)
+
     def check_or_refresh_gateway_session(self):
         """Keep track of the session expiration and refresh as necessary"""
         if self.gw_auth is not True:
             return
 
-        if self.session_expires is not None:
-            current_time = int(time.time())
-            if current_time < (self.session_expires - 10):
+        if self._gateway_session_valid():
+            return
+
+        with self._auth_lock:
+            # another thread may have logged in while we were waiting
+            if self._gateway_session_valid():
                 return
 
-        auth = {"username": self.username, "password": self.password}
-        self.gw_client = GatewayAuthClient(auth, self.gw_root_url)
-        self.response = self.gw_client.login()
-        self.headers = self.gw_client.headers
+            auth = {"username": self.username, "password": self.password}
+            self.gw_client = GatewayAuthClient(auth, self.gw_root_url)
+            response = self.gw_client.login()
+            self.response = response
+            self.headers = self.gw_client.headers
+            self._auth_generation += 1
+
+            for cookie in response.cookies:
+                if cookie.name != "gateway_sessionid":
+                    continue
+                self.session_expires = cookie.expires
+                break
 
-        for cookie in self.response.cookies:
-            if cookie.name != "gateway_sessionid":
-                continue
-            self.session_expires = cookie.expires
-            break
+    @property
+    def response(self):
+        """The last response received (by the calling thread in thread-safe mode)."""
+        if self._local is not None:
+            return getattr(self._local, "response", None)
+        return self._response
+
+    @response.setter
+    def response(self, value):
+        if self._local is not None:
+            self._local.response = value
+        else:
+            self._response = value
 
     @property
     def cookies(self):
@@ -252,12 +398,12 @@ class GalaxyClient:
         self.token_type = "Bearer"
 
     def _update_auth_headers(self):
-        self.headers.update(
-            {
-                "Accept": "application/json",
-                "Authorization": f"{self.token_type} {self.token}",
-            }
-        )
+        # replace rather than update, requests in flight keep their snapshot
+        self.headers = {
+            **self.headers,
+            "Accept": "application/json",
+            "Authorization": f"{self.token_type} {self.token}",
+        }
 
     def get_server_version(self):
         return self._http("get", self.galaxy_root.rstrip("/") + "/")[
@@ -268,6 +414,38 @@ class GalaxyClient:
         galaxy_ng_version = self.server_version
         return parse_version(galaxy_ng_version) >= parse_version(RBAC_VERSION)
 
+    def _send(self, method, url, headers, *args, hedge=False, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send():
+            return send_request_with_retry_if_504(
+                method,
+                url,
+                headers=headers,
+                verify=self.https_verify,
+                session=self.session,
+                *args,
+                **kwargs,
+            )
+
+        if hedge and self.hedge_policy is not None and method == "get":
+            send_once = send
+
+            def send():
+                return self.hedge_policy.run(send_once)
+
+        if self.circuit_breaker is None:
+            return send()
+
+        token = self.circuit_breaker.before_request(url)
+        try:
+            resp = send()
+        except BaseException:
+            self.circuit_breaker.record(token, False)
+            raise
+        self.circuit_breaker.record(token, resp.status_code < 500)
+        return resp
+
     def _http(self, method, path, *args, **kwargs):
 
         # ensure we have a valid session instead of hoping
@@ -275,111 +453,139 @@ class GalaxyClient:
         self.check_or_refresh_gateway_session()
 
         url = urljoin(self.galaxy_root.rstrip("/") + "/", path)
+        generation = self._auth_generation
         headers = kwargs.pop("headers", self.headers)
+        if headers is not None:
+            headers = dict(headers)
         parse_json = kwargs.pop("parse_json", True)
         relogin = kwargs.pop("relogin", True)
-        resp = send_request_with_retry_if_504(
-            method, url, headers=headers, verify=self.https_verify, *args, **kwargs
-        )
-        self.response = resp
+        hedge = kwargs.pop("hedge", False)
+        resp = self._send(method, url, headers, *args, hedge=hedge, **kwargs)
+        self._keep_response(resp)
+
+        # successful responses are only ever decoded, never scanned
+        if resp.status_code < 400:
+            return self._decode(resp, url) if parse_json else resp
+
+        outcome = self._classify_error(resp, relogin)
+        if outcome == _JWT_EXPIRED:
+            resp = self._retry_if_expired_token(
+                method, url, headers, generation, *args, **kwargs
+            )
+        elif outcome == _SESSION_EXPIRED:
+            logging.debug(f"Login again because of HTTP {resp.status_code}")
+            resp = self._retry_if_expired_gw_token(
+                method, url, headers, generation, *args, **kwargs
+            )
+        if resp.status_code >= 400:
+            self._raise_for_error(resp, url, parse_json)
+        return self._decode(resp, url) if parse_json else resp
+
+    def _keep_response(self, resp):
+        if self.retain_response:
+            self.response = resp
+
+    def _decode(self, resp, url):
+        try:
+            return codec.loads(resp.content)
+        except codec.DecodeError as exc:
+            logging.error(f"Cannot parse expected JSON response ({url}): {resp.text}")
+            raise ValueError("Failed to parse JSON response from API") from exc
+
+    def _classify_error(self, resp, relogin):
+        """
+        Tells whether an error response is caused by expired credentials that
+        can be refreshed. Only 401 and 403 bodies are looked at, error bodies
+        being small.
+        """
+        if resp.status_code not in (401, 403):
+            return _ERROR
         if "Invalid JWT token" in resp.text:
-            resp = self._retry_if_expired_token(method, url, headers, *args, **kwargs)
-        if parse_json:
-            try:
-                json_data = resp.json()
-            except JSONDecodeError as exc:
-                logging.error(
-                    f"Cannot parse expected JSON response ({url}): {resp.text}"
-                )
-                raise ValueError("Failed to parse JSON response from API") from exc
-            if "errors" in json_data:
-                try:
-                    error_message = json_data["errors"][0]["detail"]
-                except KeyError:
-                    error_message = ""
-                if "Invalid JWT token" in error_message:
-                    resp = self._retry_if_expired_token(
-                        method, url, headers, *args, **kwargs
-                    )
-                    return resp.json()
-                elif "permission_denied" in json_data["errors"][0]["code"]:
-                    raise GalaxyClientError(resp, resp.status_code)
-                elif (
-                    "not_authenticated" in json_data["errors"][0]["code"]
-                    or "authentication_failed" in json_data["errors"][0]["code"]
-                    or resp.status_code in (401, 403)
-                ):
-                    if self.headers.get("Cookie") is not None:
-                        if (
-                            "gateway_sessionid" in self.headers.get("Cookie")
-                            and relogin
-                        ):
-                            # we re-login only if we had already logged in, otherwise we want
-                            # to see the unauthenticated error message
-                            resp = self._retry_if_expired_gw_token(
-                                method, url, headers, *args, **kwargs
-                            )
-                            return resp.json()
-                        else:
-                            raise GalaxyClientError(resp, resp.status_code)
-                    else:
-                        raise GalaxyClientError(resp, resp.status_code)
-                else:
-                    raise GalaxyClientError(resp, *json_data["errors"])
-            if resp.status_code in (401, 403) and json_data.get("detail") is not None:
-                if (
-                    "Authentication credentials were not provided"
-                    in json_data["detail"]
-                    or "JWT has expired" in json_data["detail"]
-                ) and relogin:
-                    logging.debug(f"Login again because {json_data['detail']}")
-                    resp = self._retry_if_expired_gw_token(
-                        method, url, headers, *args, **kwargs
-                    )
-                    return resp.json()
-            if resp.status_code >= 400:
-                logging.debug(resp.json())
-                raise GalaxyClientError(resp, resp.status_code)
-            return json_data
-        else:
-            if resp.status_code == 401 and "gateway_sessionid" in self.headers.get(
-                "Cookie"
+            return _JWT_EXPIRED
+        if not relogin or self.gw_client is None:
+            return _ERROR
+
+        # we re-login only if we had already logged in, otherwise we want
+        # to see the unauthenticated error message
+        gateway_session = "gateway_sessionid" in (self.headers.get("Cookie") or "")
+        try:
+            json_data = codec.loads(resp.content)
+        except codec.DecodeError:
+            json_data = None
+        if not isinstance(json_data, dict):
+            json_data = {}
+
+        if json_data.get("errors"):
+            if "permission_denied" in json_data["errors"][0]["code"]:
+                return _ERROR
+            return _SESSION_EXPIRED if gateway_session else _ERROR
+        detail = json_data.get("detail") or ""
+        if (
+            "Authentication credentials were not provided" in detail
+            or "JWT has expired" in detail
+        ):
+            return _SESSION_EXPIRED
+        if resp.status_code == 401 and gateway_session:
+            return _SESSION_EXPIRED
+        return _ERROR
+
+    def _raise_for_error(self, resp, url, parse_json):
+        if not parse_json:
+            logging.debug(resp.text)
+            raise GalaxyClientError(resp, resp.status_code)
+
+        json_data = self._decode(resp, url)
+        errors = json_data.get("errors") if isinstance(json_data, dict) else None
+        if errors:
+            code = errors[0]["code"]
+            if (
+                "permission_denied" in code
+                or "not_authenticated" in code
+                or "authentication_failed" in code
+                or resp.status_code in (401, 403)
             ):
-                return self._retry_if_expired_gw_token(
-                    method, url, headers, *args, **kwargs
-                )
-            elif resp.status_code >= 400:
-                logging.debug(resp.text)
                 raise GalaxyClientError(resp, resp.status_code)
-            return resp
-
-    def _retry_if_expired_token(self, method, url, headers, *args, **kwargs):
-        self._refresh_jwt_token()
-        self._update_auth_headers()
-        headers.update(self.headers)
-        self.response = send_request_with_retry_if_504(
-            method, url, headers=headers, verify=self.https_verify, *args, **kwargs
-        )
-        return self.response
+            raise GalaxyClientError(resp, *errors)
+        logging.debug(json_data)
+        raise GalaxyClientError(resp, resp.status_code)
 
-    def _retry_if_expired_gw_token(self, method, url, headers, *args, **kwargs):
+    def _retry_if_expired_token(
+        self, method, url, headers, generation, *args, **kwargs
+    ):
+        with self._auth_lock:
+            # only refresh if nobody else did since the failed request was sent
+            if generation == self._auth_generation:
+                self._refresh_jwt_token()
+                self._update_auth_headers()
+                self._auth_generation += 1
+            headers = {**(headers or {}), **self.headers}
+        resp = self._send(method, url, headers, *args, **kwargs)
+        self._keep_response(resp)
+        return resp
+
+    def _retry_if_expired_gw_token(
+        self, method, url, headers, generation, *args, **kwargs
+    ):
         for _ in range(2):
-            logger.debug("Reloading gateway session id.")
-            self.response = self.gw_client.login()
-            self.headers = self.gw_client.headers
-            headers.update(self.headers)
-            self.response = send_request_with_retry_if_504(
-                method, url, headers=headers, verify=self.https_verify, *args, **kwargs
-            )
-            if self.response.status_code < 400:
-                return self.response
-            logger.debug(f"Reloading token failed: {self.response.text}")
-            time.sleep(SLEEP_SECONDS_ONETIME)
-        self.response.raise_for_status()
+            with self._auth_lock:
+                if generation == self._auth_generation:
+                    logger.debug("Reloading gateway session id.")
+                    self.gw_client.login()
+                    self.headers = self.gw_client.headers
+                    self._auth_generation += 1
+                generation = self._auth_generation
+                headers = {**(headers or {}), **self.headers}
+            resp = self._send(method, url, headers, *args, **kwargs)
+            self._keep_response(resp)
+            if resp.status_code < 400:
+                return resp
+            logger.debug(f"Reloading token failed: {resp.text}")
+            sleep_within_deadline(SLEEP_SECONDS_ONETIME, "reloading gateway session")
+        resp.raise_for_status()
 
     def _payload(self, method, path, body, *args, **kwargs):
         if isinstance(body, dict):
-            body = dumps(body)
+            body = codec.dumps(body)
         if isinstance(body, str):
             body = body.encode("utf8")
         headers = {}
@@ -389,8 +595,9 @@ class GalaxyClient:
         headers.setdefault("Content-Length", str(len(body)))
         kwargs["headers"] = headers
         kwargs["data"] = body
-        logger.debug(f"Request headers: {headers}")
-        logger.debug(f"Request body: {body}")
+        # lazy formatting, bodies can be multi-megabyte uploads
+        logger.debug("Request headers: %s", headers)
+        logger.debug("Request body: %s", body)
         return self._http(method, path, *args, **kwargs)
 
     def get_token(self):
@@ -398,8 +605,45 @@ class GalaxyClient:
         r = self.post(auth_url, body={})
         return r.get("token")
 
-    def get(self, path, *args, **kwargs):
-        return self._http("get", path, *args, **kwargs)
+    def get(self, path, *args, fields=None, exclude_fields=None, **kwargs):
+        """
+        GETs path and returns the decoded response. On pulp endpoints,
+        `fields` and `exclude_fields` (lists of field names) restrict what
+        the server serializes.
+        """
+        path = project_fields(path, fields, exclude_fields)
+        if self._singleflight is None or args or set(kwargs) - {"headers", "hedge"}:
+            return self._http("get", path, *args, **kwargs)
+
+        url = urljoin(self.galaxy_root.rstrip("/") + "/", path)
+        # every header is part of the key: the same url asked with a different
+        # Accept, or different credentials, is a different response
+        headers = kwargs.get("headers", self.headers) or {}
+        key = (url, tuple(sorted(headers.items())))
+        result, _ = self._singleflight.do(
+            key, lambda: self._http("get", path, **kwargs)
+        )
+        return result
+
+    def iter_items(
+        self,
+        path,
+        keys=("data", "results"),
+        chunk_size=64 * 1024,
+        fields=None,
+        exclude_fields=None,
+    ):
+        """
+        GETs a listing and yields the entries of its `data` or `results`
+        array one at a time, parsing the body as it is received. Unlike
+        `get`, the whole body is never held in memory at once.
+        """
+        path = project_fields(path, fields, exclude_fields)
+        resp = self._http("get", path, parse_json=False, stream=True)
+        try:
+            yield from streaming.iter_array_items(resp.iter_content(chunk_size), keys)
+        finally:
+            resp.close()
 
     def post(self, *args, **kwargs):
         return self._payload("post", *args, **kwargs)
@@ -542,22 +786,50 @@ class GalaxyClient:
         """
         return groups.add_role_to_group(self, role_name, group_id)
 
+    def stats(self):
+        """
+        Returns counters about the requests made through this client.
+        """
+        stats = {}
+        if self._singleflight is not None:
+            stats["coalesced_gets"] = self._singleflight.coalesced
+        if self.hedge_policy is not None:
+            stats.update(self.hedge_policy.stats())
+        if self.circuit_breaker is not None:
+            stats["circuit_breaker"] = self.circuit_breaker.state()
+        return stats
+
     def get_settings(self):
         return self.get("_ui/v1/settings/")
 
     def get_feature_flags(self):
         return self.get("_ui/v1/feature-flags/")
 
+    def _capability(self, name, compute):
+        """
+        Returns a cached server capability, computing it on the first lookup.
+        The cache may be shared with other clients of the same server.
+        """
+        if self._capabilities is None:
+            return compute()
+        if name not in self._capabilities:
+            self._capabilities[name] = compute()
+        return self._capabilities[name]
+
     @property
     def rbac_enabled(self):
         if self._rbac_enabled is None:
-            self._rbac_enabled = self._is_rbac_available()
+            self._rbac_enabled = self._capability(
+                "rbac_enabled", self._is_rbac_available
+            )
         return self._rbac_enabled
 
     @property
     def server_version(self):
         if self._server_version is None:
-            self._server_version = self.get_server_version()
+            self._server_version = self._capability(
+                "server_version", self.get_server_version
+            )
         return self._server_version
 
     @property
@@ -597,6 +869,9 @@ class BasicAuthClient(GalaxyClient):
 
         kwargs['auth'] = self.auth
         kwargs['verify'] = False
+        kwargs['timeout'] = request_timeout(
+            kwargs.get('timeout', (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+        )
 
         # munge body back to json if possible ...
         if kwargs.get('body'):
@@ -609,13 +884,14 @@ class BasicAuthClient(GalaxyClient):
 
         # not all endpoints return json
         parse_json = kwargs.pop("parse_json", True)
+        kwargs.pop("hedge", None)
 
         func = getattr(requests, method)
         response = func(url, **kwargs)
 
         try:
             if parse_json:
-                return response.json()
+                return codec.loads(response.content)
             return response.text
         except Exception:
             raise GalaxyClientError(response.text, response.status_code)
@@ -0,0 +1,96 @@
+"""
+JSON encoding and decoding of request and response bodies.
+
+The fastest backend installed is used: orjson when available (it's part of
+the `fast` extra, `pip install galaxykit[fast]`), simplejson otherwise. The
+GALAXYKIT_JSON_CODEC environment variable or `set_codec()` force a backend.
+"""
+
+import json
+import logging
+import os
+
+import simplejson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# every backend raises a ValueError subclass on invalid documents
+DecodeError = ValueError
+
+
+class Codec:
+    """A JSON backend: `dumps` returns bytes, `loads` accepts bytes or str."""
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f"<Codec {self.name}>"
+
+
+def _available_codecs():
+    codecs = {
+        "simplejson": Codec(
+            "simplejson",
+            lambda obj: simplejson.dumps(obj).encode("utf8"),
+            simplejson.loads,
+        ),
+        "json": Codec(
+            "json",
+            lambda obj: json.dumps(obj).encode("utf8"),
+            json.loads,
+        ),
+    }
+    if orjson is not None:
+        codecs["orjson"] = Codec("orjson", orjson.dumps, orjson.loads)
+    return codecs
+
+
+CODECS = _available_codecs()
+
+
+def get_codec(name=None):
+    """
+    Returns the named codec, or the preferred one available when no name is
+    given. Raises ValueError for unknown or uninstalled backends.
+    """
+    if name is None:
+        return CODECS.get("orjson") or CODECS["simplejson"]
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(
+            f"JSON codec '{name}' is not available, pick one of: "
+            + ", ".join(sorted(CODECS))
+        )
+
+
+_codec = get_codec(os.environ.get("GALAXYKIT_JSON_CODEC") or None)
+
+
+def set_codec(codec):
+    """Switches the codec used by galaxykit, by name or Codec instance."""
+    global _codec
+    _codec = codec if isinstance(codec, Codec) else get_codec(codec)
+    logger.debug(f"Using the {_codec.name} JSON codec.")
+
+
+def current_codec():
+    return _codec
+
+
+def dumps(obj):
+    """Encodes obj as JSON, returning bytes."""
+    return _codec.dumps(obj)
+
+
+def loads(data):
+    """Decodes a JSON document given as bytes or str."""
+    return _codec.loads(data)
@@ -5,18 +5,23 @@ Functions for managing collections. Currently only handles uploading test collec
 import uuid
 import os
 import json
-from time import sleep
 from urllib.parse import urljoin
 from packaging.version import parse as parse_version
 
 from orionutils.generator import build_collection
-from .utils import wait_for_task, logger, GalaxyClientError, wait_for_url
+from .utils import (
+    wait_for_task,
+    logger,
+    GalaxyClientError,
+    wait_for_url,
+    sleep_within_deadline,
+)
 from .constants import EE_ENDPOINTS_CHANGE_VERSION, SLEEP_SECONDS_POLLING
 
 
 def collection_info(client, repository, namespace, collection_name, version):
     url = f"v3/plugin/ansible/content/{repository}/collections/index/{namespace}/{collection_name}/versions/{version}/"
-    return client.get(url)
+    return client.get(url, hedge=True)
 
 
 def get_collection(client, namespace, collection_name, version):
@@ -25,7 +30,7 @@ def get_collection(client, namespace, collection_name, version):
         f"v3/plugin/ansible/content/published/collections/index/"
         f"{namespace}/{collection_name}/versions/{version}/"
     )
-    return client.get(collection_url)
+    return client.get(collection_url, hedge=True)
 
 
 def get_collection_from_repo(client, repository, namespace, collection_name, version):
@@ -49,6 +54,15 @@ def get_collection_list(client):
     return client.get(url)
 
 
+def iter_collection_list(client):
+    """
+    Yields the collection versions returned by get_collection_list one at a
+    time, without loading the whole listing in memory.
+    """
+    url = "_ui/v1/collection-versions/?limit=999999"
+    return client.iter_items(url)
+
+
 def get_all_collections(client):
     url = "v3/collections/"
     return client.get(url)
@@ -276,7 +290,7 @@ def move_or_copy_collection(
             client.get(dest_url)
             ready = True
         except GalaxyClientError:
-            sleep(SLEEP_SECONDS_POLLING)
+            sleep_within_deadline(SLEEP_SECONDS_POLLING, f"waiting for {dest_url}")
             timeout = timeout - 1
             if timeout < 0:
                 raise
@@ -289,10 +303,11 @@ def move_or_copy_collection(
 
 
 def delete_collection(
-    client, namespace, collection, version=None, repository="published"
+    client, namespace, collection, version=None, repository="published", wait=True
 ):
     """
-    Delete collection version
+    Delete collection version. With wait=False, returns as soon as the
+    deletion task is started.
     """
     logger.debug(f"Deleting {collection} from {namespace} on {client.galaxy_root}")
     if version is None:
@@ -300,7 +315,8 @@ def delete_collection(
     else:
         delete_url = f"v3/plugin/ansible/content/{repository}/collections/index/{namespace}/{collection}/versions/{version}/"
     resp = client.delete(delete_url)
-    wait_for_task(client, resp)
+    if wait:
+        wait_for_task(client, resp)
     return resp
 
 
@@ -6,14 +6,18 @@ from pprint import pprint
 
 from .client import GalaxyClient
 from .utils import GalaxyClientError
+from . import cleanup
 from . import collections
 from . import container_images
 from . import containers
 from . import greet
 from . import groups
+from . import manifest
 from . import namespaces
 from . import registries
 from . import roles
+from . import seed
+from . import snapshot
 from . import tasks
 from . import users
 from . import __version__ as VERSION
@@ -303,6 +307,21 @@ KIND_OPS = {
                 "help": "List all collections in the given repository",
                 "args": {"repository_name": {}},
             },
+            "diff": {
+                "help": "Compare the collection versions of two repositories",
+                "args": {
+                    "source": {},
+                    "destination": {},
+                    "--apply": {
+                        "choices": ["copy", "move"],
+                        "help": "Copy or move what's missing to the destination",
+                    },
+                    "--changed": {
+                        "action": "store_true",
+                        "help": "Also copy or move the versions that differ",
+                    },
+                },
+            },
         },
     },
     "distribution": {
@@ -508,6 +527,104 @@ KIND_OPS = {
             },
         },
     },
+    "apply": {
+        "help": "Apply a declarative state manifest (YAML)",
+        "args": {
+            "-f": {
+                "dest": "file",
+                "required": True,
+                "help": "Manifest file, see galaxykit/manifest.py for its format",
+            },
+            "--dry-run": {
+                "action": "store_true",
+                "help": "Only print the plan",
+            },
+            "--workers": {
+                "type": int,
+                "default": 8,
+                "help": "Steps applied concurrently",
+            },
+        },
+    },
+    "cleanup": {
+        "help": "Delete everything named with a prefix",
+        "args": {
+            "--prefix": {
+                "required": True,
+                "help": "Delete the objects whose name starts with this",
+            },
+            "--kinds": {
+                "help": "Comma separated kinds to delete, all by default: collections, "
+                + ", ".join(cleanup.LISTINGS),
+            },
+            "--orphans": {
+                "action": "store_true",
+                "help": "Clean up orphaned content at the end",
+            },
+            "--dry-run": {
+                "action": "store_true",
+                "help": "Only list what would be deleted",
+            },
+            "--workers": {
+                "type": int,
+                "default": 8,
+                "help": "Deletes sent concurrently",
+            },
+        },
+    },
+    "seed": {
+        "help": "Seed a synthetic dataset of collections, resumable from a journal",
+        "args": {
+            "--journal": {
+                "required": True,
+                "help": "File recording the steps done, to resume from",
+            },
+            "--prefix": {"default": "seed"},
+            "--namespaces": {"type": int, "default": 10},
+            "--collections": {
+                "type": int,
+                "default": 10,
+                "help": "Collections per namespace",
+            },
+            "--versions": {
+                "type": int,
+                "default": 3,
+                "help": "Versions per collection",
+            },
+            "--upload-to": {
+                "default": "published",
+                "help": "Repository the collections are uploaded to",
+            },
+            "--repositories": {
+                "help": "Comma separated repositories to spread the collections over",
+            },
+            "--operation": {"choices": ["copy", "move"], "default": "copy"},
+            "--sign": {"action": "store_true"},
+            "--workers": {
+                "type": int,
+                "default": 8,
+                "help": "Collections seeded concurrently",
+            },
+        },
+    },
+    "snapshot": {
+        "help": "Export users, groups, roles, namespaces, repositories, ... as NDJSON or YAML",
+        "args": {
+            "-o": {
+                "dest": "output",
+                "default": "-",
+                "help": "Output file, stdout by default",
+            },
+            "--format": {
+                "choices": ["ndjson", "yaml"],
+                "default": "ndjson",
+            },
+            "--kinds": {
+                "help": "Comma separated kinds to export, all by default: "
+                + ", ".join(snapshot.KIND_URLS),
+            },
+        },
+    },
     "url": {
         "help": "Generic GET/POST",
         "ops": {
@@ -578,7 +695,12 @@ def parse_ops(parser, ops):
 
 def parse_kind(subparsers, kind, kind_params):
     parser = subparsers.add_parser(kind, help=kind_params.get("help"))
-    parse_ops(parser, kind_params["ops"])
+    if "ops" in kind_params:
+        parse_ops(parser, kind_params["ops"])
+    else:
+        # kinds without operations take their arguments directly
+        parser.set_defaults(operation=None)
+        parse_args(parser, kind_params.get("args") or {})
 
 
 def parse_kinds(parser):
@@ -1028,6 +1150,23 @@ def main():
                     if not args.ignore:
                         logger.error(e)
                         sys.exit(EXIT_NOT_FOUND)
+            elif args.operation == "diff":
+                diff = repositories.diff_repositories(
+                    client, args.source, args.destination
+                )
+                if diff:
+                    print(diff)
+                if args.apply:
+                    report = repositories.apply_repository_diff(
+                        client, diff, args.apply, args.changed, raise_on_error=False
+                    )
+                    if report and report["failed"]:
+                        for batch in report["batches"]:
+                            if batch["state"] != "completed":
+                                logger.error(
+                                    f"Failed: batch {batch['index']}: {batch['error']}"
+                                )
+                        sys.exit(EXIT_UNKNOWN_ERROR)
         elif args.kind == "distribution":
             if args.operation == "delete":
                 name = args.name
@@ -1231,6 +1370,68 @@ def main():
                     collection_name,
                     repository,
                 )
+        elif args.kind == "apply":
+            plan = manifest.plan(client, manifest.load(args.file))
+            print(plan.format())
+            if not args.dry_run and plan.steps:
+                failed = manifest.apply_plan(client, plan, args.workers)
+                for step in failed:
+                    logger.error(f"Failed: {step}")
+                if failed:
+                    sys.exit(EXIT_UNKNOWN_ERROR)
+        elif args.kind == "cleanup":
+            kinds = args.kinds.split(",") if args.kinds else None
+            report = cleanup.cleanup(
+                client,
+                args.prefix,
+                kinds,
+                max_workers=args.workers,
+                orphans=args.orphans,
+                dry_run=args.dry_run,
+            )
+            for entry in report:
+                if args.dry_run:
+                    print(f"{entry['kind']} {entry['name']}")
+                elif entry["status"] == "failed":
+                    logger.error(
+                        f"Failed to delete {entry['kind']} {entry['name']}: "
+                        f"{entry['error']}"
+                    )
+            if any(entry["status"] == "failed" for entry in report):
+                sys.exit(EXIT_UNKNOWN_ERROR)
+        elif args.kind == "seed":
+            report = seed.seed(
+                client,
+                args.journal,
+                prefix=args.prefix,
+                namespace_count=args.namespaces,
+                collection_count=args.collections,
+                version_count=args.versions,
+                upload_to=args.upload_to,
+                destinations=args.repositories.split(",") if args.repositories else (),
+                operation=args.operation,
+                sign=args.sign,
+                max_workers=args.workers,
+            )
+            print(
+                f"{report['done']} steps done, {report['skipped']} skipped, "
+                f"{report['failed']} collections failed in {report['elapsed']:.0f}s "
+                f"({report['versions_per_second']:.2f} versions/s)"
+            )
+            if report["failed"]:
+                sys.exit(EXIT_UNKNOWN_ERROR)
+        elif args.kind == "snapshot":
+            kinds = args.kinds.split(",") if args.kinds else None
+            out = sys.stdout if args.output == "-" else open(args.output, "w")
+            try:
+                result = snapshot.write_snapshot(client, out, args.format, kinds)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            for kind, count in result["counts"].items():
+                logger.info(f"{kind}: {count}")
+            if result["errors"]:
+                sys.exit(EXIT_UNKNOWN_ERROR)
         elif args.kind == "url":
             if args.operation == "get":
                 url = args.url
@@ -0,0 +1,132 @@
+"""
+Helpers for running galaxykit calls from several threads.
+"""
+
+import contextvars
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing the same key: the first caller runs the
+    function, callers arriving while it is in flight wait for it and get the
+    same result (or exception) instead of running it again.
+
+    With a `copy` function, every caller of a shared call gets its own copy
+    of the result, the first one included, so none of them can see another
+    modify it.
+    """
+
+    def __init__(self, copy=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._copy = copy
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Runs `func` unless a call with the same key is already in flight.
+        Returns a `(result, shared)` tuple, `shared` being True when other
+        callers got the result of the same call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._copy_of(call.result), True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            # nobody can join the call anymore, and those who did are still
+            # waiting: the first caller's copy is made before they read it
+            shared = call.waiters > 0
+            result = self._copy_of(call.result) if shared else call.result
+            call.done.set()
+        return result, shared
+
+    def _copy_of(self, result):
+        return result if self._copy is None else self._copy(result)
+
+
+def run_bounded(func, items, max_workers=8, on_done=None):
+    """
+    Calls func(item) for every item from at most `max_workers` threads at a
+    time. Each call runs in a copy of the caller's context, so deadlines
+    apply to it. `on_done(item, result, error)` is called, from the caller's
+    thread, as each call finishes.
+
+    Returns a list of (item, result, error) tuples in the order of items,
+    error being the exception raised by func, or None.
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="galaxykit-worker"
+    ) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, func, item): index
+            for index, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            error = future.exception()
+            result = None if error is not None else future.result()
+            outcomes[index] = (items[index], result, error)
+            if on_done is not None:
+                on_done(items[index], result, error)
+    return outcomes
+
+
+def iter_prefetched(func, items, prefetch=4):
+    """
+    Yields func(item) for every item, in order, calling it for up to
+    `prefetch` items ahead from other threads while the results already
+    yielded are being consumed. An exception raised by func is raised when
+    its item is reached. Each call runs in a copy of the caller's context.
+    """
+    items = iter(items)
+    pending = deque()
+    executor = ThreadPoolExecutor(
+        max_workers=prefetch, thread_name_prefix="galaxykit-prefetch"
+    )
+
+    def submit(count):
+        for item in itertools.islice(items, count):
+            pending.append(executor.submit(contextvars.copy_context().run, func, item))
+
+    try:
+        submit(prefetch)
+        while pending:
+            result = pending.popleft().result()
+            submit(1)
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -7,3 +7,14 @@ EE_ENDPOINTS_CHANGE_VERSION = "4.7.0dev"
 SLEEP_SECONDS_POLLING = float(os.environ.get("GALAXYKIT_SLEEP_SECONDS_POLLING", 10))
 SLEEP_SECONDS_ONETIME = float(os.environ.get("GALAXYKIT_SLEEP_SECONDS_ONETIME", 10))
 POLLING_MAX_ATTEMPTS = int(os.environ.get("GALAXYKIT_POLLING_MAX_ATTEMPTS", 10))
+# time kept before a deadline for the waiters to poll one last time
+FINAL_POLL_SECONDS = float(os.environ.get("GALAXYKIT_FINAL_POLL_SECONDS", 1))
+
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GALAXYKIT_CONNECT_TIMEOUT_SECONDS", 30))
+READ_TIMEOUT_SECONDS = float(os.environ.get("GALAXYKIT_READ_TIMEOUT_SECONDS", 300))
+
+# longest filter value sent in one query string, proxies commonly cap URLs at 8k
+MAX_FILTER_LENGTH = int(os.environ.get("GALAXYKIT_MAX_FILTER_LENGTH", 4000))
+
+# collection versions copied or moved between repositories per task
+CONTENT_BATCH_SIZE = int(os.environ.get("GALAXYKIT_CONTENT_BATCH_SIZE", 500))
@@ -13,8 +13,10 @@ def get_distribution_href(client, name):
     """
     Returns the href for a given distribution name
     """
-    user_url = f"pulp/api/v3/distributions/ansible/ansible/?name={name}"
-    resp = client.get(user_url)
+    user_url = utils.merge_query(
+        "pulp/api/v3/distributions/ansible/ansible/", name=name, limit=1
+    )
+    resp = client.get(user_url, fields=["pulp_href"])
     if resp["results"] and resp["results"][0]:
         href = resp["results"][0]["pulp_href"]
         return href
@@ -22,6 +24,14 @@ def get_distribution_href(client, name):
         raise ValueError(f"No remote '{name}' found.")
 
 
+def resolve_distributions(client, names, fields=None):
+    """
+    Returns the ansible distributions with the given names, keyed by name.
+    """
+    url = "pulp/api/v3/distributions/ansible/ansible/"
+    return utils.resolve_in(client, url, "name__in", names, "name", fields)
+
+
 def delete_distribution(client, name):
     """
     Delete distribution
@@ -31,12 +41,14 @@ def delete_distribution(client, name):
     return client.delete(delete_url, parse_json=False)
 
 
-def create_distribution(client, name):
+def create_distribution(client, name, repository_href=None, hydrate=False):
     """
-    Create distribution from repository
+    Create distribution from repository. The repository with the same name
+    is looked up unless its href is given. Returns the creation task, or
+    with hydrate=True waits for it and returns the new distribution.
     """
 
-    repository = repositories.get_repository_href(client, name)
+    repository = repository_href or repositories.get_repository_href(client, name)
 
     post_url = f"pulp/api/v3/distributions/ansible/ansible/"
     data = {
@@ -46,9 +58,27 @@ def create_distribution(client, name):
     }
 
     res = client.post(post_url, data)
+    if hydrate:
+        return utils.wait_for_created(client, res, hydrate=True)[0]
     return res
 
 
+def ensure_distribution(client, name, repository_href=None):
+    """
+    Creates a distribution, see create_distribution, unless it already
+    exists. Returns a "created" flag and the distribution.
+    """
+
+    def get():
+        url = "pulp/api/v3/distributions/ansible/ansible/"
+        return client.get(utils.merge_query(url, name=name, limit=1))["results"][0]
+
+    return utils.ensure(
+        lambda: create_distribution(client, name, repository_href, hydrate=True),
+        get,
+    )
+
+
 def get_all_distributions(client):
     """
     Lists all distributions
@@ -4,6 +4,9 @@ from urllib.parse import urlparse
 
 import requests
 
+from galaxykit.constants import CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS
+from galaxykit.utils import request_timeout
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,8 +20,14 @@ class GitHubSocialAuthClient:
     GITHUB_LOGIN_URL = "https://github.com/login"
     GITHUB_AUTH_URL = "https://github.com/login/oauth/authorize"
 
-    def __init__(self, auth, galaxy_root):
+    def __init__(
+        self,
+        auth,
+        galaxy_root,
+        timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+    ):
         self.auth = auth
+        self.timeout = timeout
         self.galaxy_root = galaxy_root
         self.headers = {}
         parsed_url = urlparse(self.galaxy_root)
@@ -46,13 +55,19 @@ class GitHubSocialAuthClient:
         self.github_cookies = self._github_login(session)
         logger.debug(f"github cookies {dict(self.github_cookies)}")
         response = session.get(
-            self.login_url, cookies=self.github_cookies, allow_redirects=False
+            self.login_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         next_url = response.headers["location"]
         logger.debug(f"github redirect {next_url}")
         response = session.get(
-            next_url, cookies=self.github_cookies, allow_redirects=False
+            next_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         try:
@@ -66,7 +81,10 @@ class GitHubSocialAuthClient:
 
         # we expect this to just simply login ... ?
         response = session.get(
-            complete_url, cookies=self.github_cookies, allow_redirects=False
+            complete_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         cookies = get_cookies_from_response(response)
@@ -77,12 +95,18 @@ class GitHubSocialAuthClient:
         self.github_cookies = self._github_login(session)
         logger.debug(f"cookies after github login {self.github_cookies}")
         response = session.get(
-            self.login_url, cookies=self.github_cookies, allow_redirects=False
+            self.login_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         next_url = response.headers["location"]
         response = session.get(
-            next_url, cookies=self.github_cookies, allow_redirects=False
+            next_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         new_authenticity_token = extract_authenticity_token(response.text)
@@ -101,10 +125,14 @@ class GitHubSocialAuthClient:
                 "authorize": 1,
             },
             cookies=self.github_cookies,
+            timeout=request_timeout(self.timeout),
         )
         complete_url = extract_complete_url(r.text)
         response = session.get(
-            complete_url, cookies=self.github_cookies, allow_redirects=False
+            complete_url,
+            cookies=self.github_cookies,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         response.raise_for_status()
         return get_cookies_from_response(response)
@@ -122,7 +150,10 @@ class GitHubSocialAuthClient:
             "_device_id", "4066e3c5dbc8a65829b6a1b8eecbb476", domain="github.com"
         )
         resp = session.post(
-            self.GITHUB_SESSION_URL, data=login_data, allow_redirects=False
+            self.GITHUB_SESSION_URL,
+            data=login_data,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
         )
         logger.debug(f"github login POST response {resp.status_code} {resp.reason}")
         if "Incorrect username or password" in resp.text:
@@ -130,7 +161,9 @@ class GitHubSocialAuthClient:
         return session.cookies
 
     def get_authenticity_token(self, session):
-        response = session.get(self.GITHUB_LOGIN_URL)
+        response = session.get(
+            self.GITHUB_LOGIN_URL, timeout=request_timeout(self.timeout)
+        )
         response.raise_for_status()
         token_pattern = r'name="authenticity_token" value="(.+?)"'
         match = re.search(token_pattern, response.text)
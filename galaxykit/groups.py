@@ -1,7 +1,9 @@
 import json
 from pprint import pprint
 
+from . import models
 from . import roles
+from .concurrency import run_bounded
 from .utils import GalaxyClientError
 from . import utils
 
@@ -35,6 +37,15 @@ def get_group_id(client, group_name):
         raise ValueError(f"No group '{group_name}' found.")
 
 
+def resolve_groups(client, group_names, fields=None):
+    """
+    Returns the groups with the given names, keyed by name. The groups come
+    from pulp/api/v3/groups/, their ids are the ones used by _ui/v1 too.
+    """
+    url = "pulp/api/v3/groups/"
+    return utils.resolve_in(client, url, "name__in", group_names, "name", fields)
+
+
 def create_group(client, group_name, exists_ok=True):
     """
     Creates a group
@@ -49,6 +60,17 @@ def create_group(client, group_name, exists_ok=True):
             raise
 
 
+def ensure_group(client, group_name):
+    """
+    Creates the group unless it already exists. Returns a "created" flag
+    and the group.
+    """
+    return utils.ensure(
+        lambda: client.post("_ui/v1/groups/", {"name": group_name}),
+        lambda: get_group(client, group_name),
+    )
+
+
 def create_group_v3(client, group_name, exists_ok=True):
     """
     Creates a group
@@ -131,6 +153,15 @@ def get_group_list(client):
     return client.get("_ui/v1/groups/")
 
 
+def iter_groups(client, records=False):
+    """
+    Yields every group in the system, as models.Group records with
+    records=True.
+    """
+    url = "_ui/v1/groups/?limit=100"
+    return utils.iter_results(client, url, models.Group if records else None)
+
+
 def add_user_to_group(client, username, group_id):
     """
     Adds a user to a group
@@ -208,3 +239,178 @@ def delete_permission(client, group_name, permission):
             perm_id = perm["id"]
             perm_url = f"_ui/v1/groups/{group_id}/model-permissions/{perm_id}/"
             client.delete(perm_url, parse_json=False)
+
+
+def sync_group_permissions(
+    client, group_name, permissions, remove=True, dry_run=False, max_workers=8
+):
+    """
+    Makes the group have exactly the given permissions (or at least them,
+    with remove=False). The current permissions are read once, and only the
+    missing ones are added and the extra ones removed, concurrently. With
+    dry_run=True, nothing is changed.
+
+    Returns a report of the changes:
+    {"group", "added", "removed", "unchanged", "failed"}, "failed" listing
+    {"permission", "action", "error"} for the changes that didn't apply.
+    """
+    group_id = get_group(client, group_name)["id"]
+    permissions_url = f"_ui/v1/groups/{group_id}/model-permissions/"
+    current = {
+        perm["permission"]: perm["id"]
+        for perm in utils.iter_results(client, f"{permissions_url}?limit=100")
+    }
+    desired = set(permissions)
+    changes = [("add", perm) for perm in sorted(desired - set(current))]
+    if remove:
+        changes += [("remove", perm) for perm in sorted(set(current) - desired)]
+    report = {
+        "group": group_name,
+        "added": [],
+        "removed": [],
+        "unchanged": sorted(desired & set(current)),
+        "failed": [],
+    }
+
+    def apply(change):
+        action, perm = change
+        if action == "add":
+            return client.post(permissions_url, {"permission": perm})
+        perm_url = f"{permissions_url}{current[perm]}/"
+        return client.delete(perm_url, parse_json=False)
+
+    if dry_run:
+        outcomes = [(change, None, None) for change in changes]
+    else:
+        outcomes = run_bounded(apply, changes, max_workers)
+    for (action, perm), _, error in outcomes:
+        if error is not None:
+            report["failed"].append(
+                {"permission": perm, "action": action, "error": str(error)}
+            )
+        else:
+            report["added" if action == "add" else "removed"].append(perm)
+    return report
+
+
+def assign_roles(client, grants, max_workers=8, dry_run=False):
+    """
+    Grants roles to groups in bulk. `grants` is an iterable of
+    (group_name, role_name, content_object) tuples, content_object being
+    the pulp_href of the object the role applies to, or None for a global
+    role. Groups and roles are resolved in batch, the grants each group
+    already has are listed once, and only the missing grants are created,
+    concurrently. With dry_run=True, nothing is changed.
+
+    Returns one result per distinct grant:
+    {"group", "role", "content_object", "status", "error"}, status being
+    "created", "exists" or "failed" ("pending" with dry_run=True).
+    """
+    results = {
+        grant: {
+            "group": grant[0],
+            "role": grant[1],
+            "content_object": grant[2],
+            "status": None,
+            "error": None,
+        }
+        for grant in dict.fromkeys(tuple(grant) for grant in grants)
+    }
+
+    def fail(grant, error):
+        results[grant]["status"] = "failed"
+        results[grant]["error"] = error
+
+    group_ids = {
+        name: group["id"]
+        for name, group in resolve_groups(
+            client, {grant[0] for grant in results}, fields=["id"]
+        ).items()
+    }
+    known_roles = roles.resolve_roles(
+        client, {grant[1] for grant in results}, fields=["name"]
+    )
+    wanted = {}
+    for grant in results:
+        group_name, role_name, _ = grant
+        if group_name not in group_ids:
+            fail(grant, f"No group '{group_name}' found.")
+        elif role_name not in known_roles:
+            fail(grant, f"No role '{role_name}' found.")
+        else:
+            wanted.setdefault(group_name, []).append(grant)
+
+    def list_assigned(group_name):
+        url = utils.merge_query(
+            f"pulp/api/v3/groups/{group_ids[group_name]}/roles/",
+            role__in=sorted({grant[1] for grant in wanted[group_name]}),
+            limit=100,
+        )
+        return {
+            (group_name, assigned["role"], assigned["content_object"])
+            for assigned in utils.iter_results(client, url)
+        }
+
+    pending = []
+    listed = run_bounded(list_assigned, wanted, max_workers)
+    for group_name, assigned, error in listed:
+        for grant in wanted[group_name]:
+            if error is not None:
+                fail(grant, str(error))
+            elif grant in assigned:
+                results[grant]["status"] = "exists"
+            else:
+                pending.append(grant)
+
+    def grant_role(grant):
+        group_name, role_name, content_object = grant
+        roles_url = f"pulp/api/v3/groups/{group_ids[group_name]}/roles/"
+        body = {"role": role_name, "content_object": content_object}
+        return client.post(roles_url, body)
+
+    if dry_run:
+        for grant in pending:
+            results[grant]["status"] = "pending"
+    else:
+        for grant, _, error in run_bounded(grant_role, pending, max_workers):
+            if error is None:
+                results[grant]["status"] = "created"
+            elif isinstance(error, GalaxyClientError) and utils.is_conflict(error):
+                results[grant]["status"] = "exists"
+            else:
+                fail(grant, str(error))
+    return list(results.values())
+
+
+def provision_groups(client, group_names, max_workers=8):
+    """
+    Creates the groups that don't exist yet. The existing groups are listed
+    in one paginated sweep, and only the missing ones are created,
+    concurrently.
+
+    Returns a report: {"created", "existing", "failed", "errors"}, the first
+    three being counts and "errors" listing {"group", "error"}.
+    """
+    group_names = list(dict.fromkeys(group_names))
+    url = "pulp/api/v3/groups/?limit=1000&fields=name"
+    existing = {group["name"] for group in utils.iter_results(client, url)}
+    missing = [name for name in group_names if name not in existing]
+    report = {
+        "created": 0,
+        "existing": len(group_names) - len(missing),
+        "failed": 0,
+        "errors": [],
+    }
+
+    def create(name):
+        return client.post("_ui/v1/groups/", {"name": name})
+
+    for name, _, error in run_bounded(create, missing, max_workers):
+        if error is None:
+            report["created"] += 1
+        elif isinstance(error, GalaxyClientError) and utils.is_conflict(error):
+            report["existing"] += 1
+        else:
+            report["failed"] += 1
+            report["errors"].append({"group": name, "error": str(error)})
+    return report
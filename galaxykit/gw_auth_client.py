@@ -4,14 +4,21 @@ from urllib.parse import urlparse
 
 import requests
 
-from galaxykit.utils import GalaxyClientError
+from galaxykit.constants import CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS
+from galaxykit.utils import GalaxyClientError, request_timeout
 
 logger = logging.getLogger(__name__)
 
 
 class GatewayAuthClient:
-    def __init__(self, auth, galaxy_root):
+    def __init__(
+        self,
+        auth,
+        galaxy_root,
+        timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+    ):
         self.auth = auth
+        self.timeout = timeout
         self.galaxy_root = galaxy_root
         self.headers = {}
         parsed_url = urlparse(self.galaxy_root)
@@ -46,7 +53,7 @@ class GatewayAuthClient:
         self.session.headers.update({"Origin": self.url})
         self.session.headers.update({"Referer": f"{self.url}/overview"})
         self.session.headers.update({"X-CSRFToken": self.csrftoken})
-        self.session.post(self.logout_url)
+        self.session.post(self.logout_url, timeout=request_timeout(self.timeout))
         return self.session
 
     def _gw_login(self, session):
@@ -59,7 +66,12 @@ class GatewayAuthClient:
             "username": (None, self.auth["username"]),
             "password": (None, self.auth["password"]),
         }
-        response = session.post(self.login_url, files=data, allow_redirects=False)
+        response = session.post(
+            self.login_url,
+            files=data,
+            allow_redirects=False,
+            timeout=request_timeout(self.timeout),
+        )
         if response.status_code == 401:
             raise GalaxyClientError(
                 "401 Unauthorized. Incorrect username or password.",
@@ -68,7 +80,7 @@ class GatewayAuthClient:
         return response
 
     def get_header_csfrtoken(self, session):
-        response = session.get(self.login_url)
+        response = session.get(self.login_url, timeout=request_timeout(self.timeout))
         response.raise_for_status()
         token_pattern = r'"csrfToken":\s+?"(.+?)"'
         match = re.search(token_pattern, response.text)
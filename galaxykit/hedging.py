@@ -0,0 +1,167 @@
+"""
+Hedged requests: when a read takes unusually long, send a second copy of it
+and use whichever answer arrives first.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+def _discard(future):
+    """Releases the connection held by a response nobody is going to read."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    future.result()[0].close()
+
+
+def _timed(send):
+    """Calls send, returns its response and how long it took once sent."""
+    started = time.monotonic()
+    resp = send()
+    return resp, time.monotonic() - started
+
+
+def _start_thread(func):
+    """Runs func on a thread of its own, returns a future of its result."""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    # in a copy of the caller's context, so deadlines still apply
+    threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(target,),
+        name="galaxykit-hedge-primary",
+        daemon=True,
+    ).start()
+    return future
+
+
+class HedgePolicy:
+    """
+    Decides when and how often to hedge a request.
+
+    A duplicate request is sent once the original has been running for
+    `delay` seconds or, when no delay is given, for longer than the observed
+    `percentile` latency (which needs `min_samples` observations first).
+    Hedges are limited so they never exceed `budget` (a ratio, 0.05 = 5%)
+    of the requests going through the policy.
+
+    Only idempotent GETs should be hedged. The losing request can't be
+    aborted mid-flight with `requests`; its response is closed as soon as it
+    arrives so the connection goes back to the pool.
+    """
+
+    def __init__(
+        self,
+        delay=None,
+        percentile=0.95,
+        budget=0.05,
+        min_samples=20,
+        window=1000,
+        max_workers=16,
+    ):
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="galaxykit-hedge"
+        )
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+
+    def hedge_delay(self):
+        """Returns how long to wait before hedging, None to not hedge at all."""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.percentile), len(latencies) - 1)
+        return latencies[index]
+
+    def _observe(self, elapsed):
+        with self._lock:
+            self._latencies.append(elapsed)
+
+    def _has_budget(self):
+        return self._hedged + 1 <= self.budget * self._requests
+
+    def _take_budget(self):
+        with self._lock:
+            if not self._has_budget():
+                return False
+            self._hedged += 1
+            return True
+
+    def run(self, send):
+        """
+        Calls `send` (a function returning a requests.Response), hedging it
+        according to the policy, and returns the first response received.
+        """
+        with self._lock:
+            self._requests += 1
+        delay = self.hedge_delay()
+        if delay is None or not self._has_budget():
+            # no hedge possible, no need to leave the calling thread
+            resp, elapsed = _timed(send)
+            self._observe(elapsed)
+            return resp
+
+        # the primary gets a thread of its own rather than queueing behind
+        # other requests in the executor, whose queue time would both trigger
+        # hedges and count as latency
+        primary = _start_thread(lambda: _timed(send))
+        wait([primary], timeout=delay)
+        if primary.done() or not self._take_budget():
+            resp, elapsed = primary.result()
+            self._observe(elapsed)
+            return resp
+
+        logger.debug(f"Request still running after {delay:.3f}s, hedging it.")
+        hedge = self._executor.submit(contextvars.copy_context().run, _timed, send)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for other in pending:
+                    if not other.cancel():
+                        other.add_done_callback(_discard)
+                for other in done - {future}:
+                    _discard(other)
+                resp, elapsed = future.result()
+                self._observe(elapsed)
+                if future is hedge:
+                    with self._lock:
+                        self._hedge_wins += 1
+                return resp
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedge_requests": self._requests,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+            }
@@ -0,0 +1,608 @@
+"""
+Declarative hub state, applied with `galaxykit apply -f state.yaml`.
+
+The manifest lists the objects that must exist, by kind:
+
+    remotes:
+      - name: community
+        url: https://galaxy.ansible.com/api/
+    groups:
+      - name: devs
+        roles: [galaxy.content_admin]  # global roles
+    roles:
+      - name: galaxy.custom
+        description: Custom role
+        permissions: [galaxy.add_namespace]
+    users:
+      - username: alice
+        password: secret
+        email: alice@example.com
+        groups: [devs]
+    namespaces:
+      - name: acme
+        groups:
+          - name: devs
+            object_roles: [galaxy.collection_namespace_owner]
+    repositories:
+      - name: certified
+        description: Certified content
+        remote: community
+        pipeline: approved
+        private: false
+    distributions:
+      - name: certified
+        repository: certified  # defaults to the distribution name
+
+The current state is read once per kind and compared with the manifest,
+giving a plan of the creates and updates needed. Applying is additive:
+objects, group grants and memberships missing from the manifest are left
+alone, and write-only fields (passwords, remote credentials) are only set
+on creation. Steps run in dependency order (groups, roles and remotes,
+then users, namespaces, repositories and group grants, then
+distributions), the independent ones concurrently.
+"""
+
+import logging
+
+import yaml
+
+from . import distributions
+from . import groups
+from . import remotes
+from . import repositories
+from . import roles
+from . import users
+from . import utils
+from .concurrency import run_bounded
+
+logger = logging.getLogger(__name__)
+
+KINDS = (
+    "remotes",
+    "groups",
+    "roles",
+    "users",
+    "namespaces",
+    "repositories",
+    "distributions",
+)
+
+DISTRIBUTIONS_URL = "pulp/api/v3/distributions/ansible/ansible/"
+
+# user fields compared with the manifest, the password being write-only
+USER_FIELDS = ("email", "first_name", "last_name", "is_superuser")
+
+
+def load(path):
+    """Reads a manifest file, returning its entries by kind."""
+    with open(path) as f:
+        manifest = yaml.safe_load(f) or {}
+    unknown = set(manifest) - set(KINDS)
+    if unknown:
+        raise ValueError(
+            f"Unknown kinds in {path}: {', '.join(sorted(unknown))}. "
+            f"Supported kinds: {', '.join(KINDS)}"
+        )
+    for kind, entries in manifest.items():
+        key = "username" if kind == "users" else "name"
+        for entry in entries or ():
+            if not isinstance(entry, dict) or key not in entry:
+                raise ValueError(f"Every entry of '{kind}' needs a '{key}'.")
+    return {kind: manifest.get(kind) or [] for kind in KINDS}
+
+
+class Step:
+    """One create or update of the plan."""
+
+    def __init__(self, kind, name, action, changes, run):
+        self.kind = kind
+        self.name = name
+        self.action = action
+        self.changes = changes
+        self.run = run
+        self.status = "planned"
+        self.error = None
+
+    def __str__(self):
+        symbol = "+" if self.action == "create" else "~"
+        line = f"{symbol} {self.kind} {self.name}"
+        if self.changes:
+            line += ": " + "; ".join(self.changes)
+        if self.status not in ("planned", "done"):
+            line += f" [{self.status}{': ' + self.error if self.error else ''}]"
+        return line
+
+
+class Plan:
+    """The steps to apply, in layers that must run one after the other."""
+
+    def __init__(self):
+        self.layers = [[], [], []]
+        # names to ids and hrefs of the objects referred to, completed by the
+        # steps creating objects
+        self.group_ids = {}
+        self.remote_hrefs = {}
+        self.repository_hrefs = {}
+
+    @property
+    def steps(self):
+        return [step for layer in self.layers for step in layer]
+
+    def failed(self):
+        return [step for step in self.steps if step.status == "failed"]
+
+    def format(self):
+        if not self.steps:
+            return "Nothing to do, the server matches the manifest."
+        return "\n".join(str(step) for step in self.steps)
+
+
+def _diff(wanted, current, keys):
+    """Returns the wanted values of keys that differ from the current ones."""
+    return {
+        key: wanted[key]
+        for key in keys
+        if key in wanted and key in current and wanted[key] != current[key]
+    }
+
+
+def _wait_if_task(client, resp):
+    if isinstance(resp, dict) and "task" in resp:
+        utils.wait_for_task(client, resp, raise_on_error=True)
+    return resp
+
+
+def _plan_groups(client, plan, entries):
+    existing = groups.resolve_groups(
+        client, [entry["name"] for entry in entries], fields=["id"]
+    )
+    plan.group_ids.update({name: group["id"] for name, group in existing.items()})
+    grants = [
+        (entry["name"], role, None)
+        for entry in entries
+        for role in entry.get("roles") or ()
+    ]
+    pending = set()
+    if grants:
+        pending = {
+            (result["group"], result["role"])
+            for result in groups.assign_roles(client, grants, dry_run=True)
+            if result["status"] != "exists"
+        }
+    for entry in entries:
+        name = entry["name"]
+        if name not in existing:
+
+            def create(name=name):
+                group = client.post("_ui/v1/groups/", {"name": name})
+                plan.group_ids[name] = group["id"]
+
+            plan.layers[0].append(Step("group", name, "create", [], create))
+        missing = [role for role in entry.get("roles") or () if (name, role) in pending]
+        if missing:
+
+            def grant(name=name, missing=missing):
+                results = groups.assign_roles(
+                    client, [(name, role, None) for role in missing]
+                )
+                errors = [r["error"] for r in results if r["status"] == "failed"]
+                if errors:
+                    raise ValueError("; ".join(errors))
+
+            changes = [f"grant {', '.join(missing)}"]
+            plan.layers[1].append(Step("group", name, "update", changes, grant))
+
+
+def _plan_roles(client, plan, entries):
+    existing = roles.resolve_roles(
+        client,
+        [entry["name"] for entry in entries],
+        fields=["pulp_href", "description", "permissions"],
+    )
+    for entry in entries:
+        name = entry["name"]
+        role = existing.get(name)
+        if role is None:
+            payload = {
+                "name": name,
+                "description": entry.get("description", ""),
+                "permissions": entry.get("permissions") or [],
+            }
+
+            def create(payload=payload):
+                client.post("pulp/api/v3/roles/", payload)
+
+            plan.layers[0].append(Step("role", name, "create", [], create))
+            continue
+
+        changes, payload = [], {}
+        if "permissions" in entry:
+            added = set(entry["permissions"]) - set(role["permissions"])
+            removed = set(role["permissions"]) - set(entry["permissions"])
+            if added or removed:
+                payload["permissions"] = sorted(entry["permissions"])
+                changes += [f"+{perm}" for perm in sorted(added)]
+                changes += [f"-{perm}" for perm in sorted(removed)]
+        if "description" in entry and entry["description"] != role["description"]:
+            payload["description"] = entry["description"]
+            changes.append("description")
+        if payload:
+
+            def update(href=role["pulp_href"], payload=payload):
+                client.patch(href, payload)
+
+            plan.layers[0].append(Step("role", name, "update", changes, update))
+
+
+def _plan_remotes(client, plan, entries):
+    existing = remotes.resolve_remotes(client, [entry["name"] for entry in entries])
+    plan.remote_hrefs.update(
+        {name: remote["pulp_href"] for name, remote in existing.items()}
+    )
+    for entry in entries:
+        name = entry["name"]
+        params = {k: v for k, v in entry.items() if k not in ("name", "url")}
+        remote = existing.get(name)
+        if remote is None:
+
+            def create(name=name, url=entry.get("url"), params=params):
+                created = remotes.create_remote(client, name, url, params=params)
+                plan.remote_hrefs[name] = created["pulp_href"]
+
+            plan.layers[0].append(Step("remote", name, "create", [], create))
+            continue
+
+        changed = _diff(entry, remote, set(entry) - {"name"})
+        if changed:
+
+            def update(href=remote["pulp_href"], changed=changed):
+                _wait_if_task(client, client.patch(href, changed))
+
+            changes = sorted(changed)
+            plan.layers[0].append(Step("remote", name, "update", changes, update))
+
+
+def _plan_users(client, plan, entries):
+    # pulp's users don't have is_superuser, galaxy's do and are what's PUT back
+    wanted = {entry["username"] for entry in entries}
+    existing = {
+        user["username"]: user
+        for user in utils.iter_results(client, "_ui/v1/users/?limit=100")
+        if user["username"] in wanted
+    }
+
+    def add_to_groups(username, group_names):
+        for name in group_names:
+            groups.add_user_to_group(client, username, plan.group_ids[name])
+
+    for entry in entries:
+        username = entry["username"]
+        user = existing.get(username)
+        current_groups = {group["name"] for group in (user or {}).get("groups", ())}
+        memberships = [
+            name for name in entry.get("groups") or () if name not in current_groups
+        ]
+        changes = [f"groups +{', '.join(memberships)}"] if memberships else []
+        if user is None:
+
+            def create(entry=entry, memberships=memberships):
+                users.create_user(
+                    client,
+                    entry["username"],
+                    entry.get("password"),
+                    None,
+                    entry.get("first_name", ""),
+                    entry.get("last_name", ""),
+                    entry.get("email", ""),
+                    entry.get("is_superuser", False),
+                )
+                add_to_groups(entry["username"], memberships)
+
+            plan.layers[1].append(Step("user", username, "create", changes, create))
+            continue
+
+        changed = _diff(entry, user, USER_FIELDS)
+        if changed or memberships:
+
+            def update(user=user, changed=changed, memberships=memberships):
+                if changed:
+                    users.update_user(client, {**user, **changed})
+                add_to_groups(user["username"], memberships)
+
+            changes = sorted(changed) + changes
+            plan.layers[1].append(Step("user", username, "update", changes, update))
+
+
+def _namespace_group(plan, name, object_roles):
+    return {
+        "id": plan.group_ids[name],
+        "name": name,
+        "object_permissions": ["change_namespace", "upload_to_namespace"],
+        "object_roles": object_roles,
+    }
+
+
+def _plan_namespaces(client, plan, entries):
+    wanted = {entry["name"] for entry in entries}
+    listed = {
+        namespace["name"]
+        for namespace in utils.iter_results(client, "v3/namespaces/?limit=100")
+        if namespace["name"] in wanted
+    }
+    # the listing only has a summary of each namespace, without its groups:
+    # the namespaces to compare are read in full, and PUT back from that
+    compared = [
+        entry["name"] for entry in entries if entry["name"] in listed and len(entry) > 1
+    ]
+    existing = dict.fromkeys(listed)
+    for name, namespace, error in run_bounded(
+        lambda name: client.get(f"v3/namespaces/{name}/"), compared
+    ):
+        if error is not None:
+            raise error
+        existing[name] = namespace
+    for entry in entries:
+        name = entry["name"]
+        fields = {k: v for k, v in entry.items() if k not in ("name", "groups")}
+        wanted_groups = {
+            group["name"]: sorted(group.get("object_roles") or [])
+            for group in entry.get("groups") or ()
+        }
+        if name not in existing:
+
+            def create(name=name, fields=fields, wanted_groups=wanted_groups):
+                body = {
+                    "name": name,
+                    "groups": [
+                        _namespace_group(plan, group, object_roles)
+                        for group, object_roles in wanted_groups.items()
+                    ],
+                    **fields,
+                }
+                client.post("v3/namespaces/", body)
+
+            plan.layers[1].append(Step("namespace", name, "create", [], create))
+            continue
+
+        namespace = existing[name]
+        if namespace is None:
+            continue
+        current_groups = {
+            group["name"]: sorted(group.get("object_roles") or [])
+            for group in namespace.get("groups") or ()
+        }
+        changed_groups = {
+            group: object_roles
+            for group, object_roles in wanted_groups.items()
+            if current_groups.get(group) != object_roles
+        }
+        changed = _diff(fields, namespace, fields)
+        if not changed_groups and not changed:
+            continue
+        changes = sorted(changed) + [f"group {group}" for group in changed_groups]
+
+        def update(namespace=namespace, changed=changed, changed_groups=changed_groups):
+            body = {**namespace, **changed}
+            body["groups"] = [
+                group
+                for group in namespace.get("groups") or ()
+                if group["name"] not in changed_groups
+            ] + [
+                _namespace_group(plan, group, object_roles)
+                for group, object_roles in changed_groups.items()
+            ]
+            client.put(f"v3/namespaces/{namespace['name']}/", body)
+
+        plan.layers[1].append(Step("namespace", name, "update", changes, update))
+
+
+def _repository_fields(plan, entry, labels=None):
+    """Returns the API fields of a repository entry, merging in labels."""
+    fields = {k: v for k, v in entry.items() if k not in ("name", "remote", "pipeline")}
+    if "remote" in entry:
+        fields["remote"] = plan.remote_hrefs.get(entry["remote"], entry["remote"])
+    if "pipeline" in entry:
+        fields["pulp_labels"] = {**(labels or {}), "pipeline": entry["pipeline"]}
+    return fields
+
+
+def _plan_repositories(client, plan, entries):
+    existing = repositories.resolve_repositories(
+        client, [entry["name"] for entry in entries]
+    )
+    plan.repository_hrefs.update(
+        {name: repo["pulp_href"] for name, repo in existing.items()}
+    )
+    for entry in entries:
+        name = entry["name"]
+        repo = existing.get(name)
+        if repo is None:
+
+            def create(entry=entry):
+                body = {"name": entry["name"], **_repository_fields(plan, entry)}
+                created = client.post("pulp/api/v3/repositories/ansible/ansible/", body)
+                plan.repository_hrefs[entry["name"]] = created["pulp_href"]
+
+            plan.layers[1].append(Step("repository", name, "create", [], create))
+            continue
+
+        labels = repo["pulp_labels"]
+        wanted = _repository_fields(plan, entry, labels)
+        changes = sorted(_diff(wanted, repo, wanted))
+        if changes:
+
+            def update(
+                href=repo["pulp_href"], entry=entry, labels=labels, keys=changes
+            ):
+                # hrefs of remotes created by the plan are only known by now
+                fields = _repository_fields(plan, entry, labels)
+                payload = {key: fields[key] for key in keys}
+                _wait_if_task(client, client.patch(href, payload))
+
+            plan.layers[1].append(Step("repository", name, "update", changes, update))
+
+
+def _plan_distributions(client, plan, entries):
+    existing = distributions.resolve_distributions(
+        client, [entry["name"] for entry in entries]
+    )
+    for entry in entries:
+        name = entry["name"]
+        repository = entry.get("repository", name)
+        base_path = entry.get("base_path", name)
+        dist = existing.get(name)
+        if dist is None:
+
+            def create(name=name, repository=repository, base_path=base_path):
+                body = {
+                    "name": name,
+                    "base_path": base_path,
+                    "repository": plan.repository_hrefs[repository],
+                }
+                _wait_if_task(client, client.post(DISTRIBUTIONS_URL, body))
+
+            plan.layers[2].append(Step("distribution", name, "create", [], create))
+            continue
+
+        changes = []
+        if dist["base_path"] != base_path:
+            changes.append("base_path")
+        if dist["repository"] != plan.repository_hrefs.get(repository):
+            changes.append("repository")
+        if changes:
+
+            def update(
+                href=dist["pulp_href"], repository=repository, base_path=base_path
+            ):
+                body = {
+                    "base_path": base_path,
+                    "repository": plan.repository_hrefs[repository],
+                }
+                _wait_if_task(client, client.patch(href, body))
+
+            plan.layers[2].append(Step("distribution", name, "update", changes, update))
+
+
+def _resolve_references(client, plan, manifest):
+    """
+    Looks up the groups, remotes and repositories the manifest refers to
+    without listing them itself. Raises ValueError for those that don't
+    exist, rather than failing half way through applying.
+    """
+
+    def declared(kind):
+        return {entry["name"] for entry in manifest.get(kind) or ()}
+
+    referenced_groups = {
+        name
+        for user in manifest.get("users") or ()
+        for name in user.get("groups") or ()
+    } | {
+        group["name"]
+        for namespace in manifest.get("namespaces") or ()
+        for group in namespace.get("groups") or ()
+    }
+    referenced_remotes = {
+        repo["remote"]
+        for repo in manifest.get("repositories") or ()
+        if repo.get("remote") and not repo["remote"].startswith("/")
+    }
+    referenced_repositories = {
+        dist.get("repository", dist["name"])
+        for dist in manifest.get("distributions") or ()
+    }
+
+    def group_ids(names):
+        found = groups.resolve_groups(client, names, fields=["id"])
+        return {name: group["id"] for name, group in found.items()}
+
+    def remote_hrefs(names):
+        found = remotes.resolve_remotes(client, names, fields=["pulp_href"])
+        return {name: remote["pulp_href"] for name, remote in found.items()}
+
+    def repository_hrefs(names):
+        found = repositories.resolve_repositories(client, names, fields=["pulp_href"])
+        return {name: repo["pulp_href"] for name, repo in found.items()}
+
+    lookups = [
+        ("group", referenced_groups - declared("groups"), group_ids, plan.group_ids),
+        (
+            "remote",
+            referenced_remotes - declared("remotes"),
+            remote_hrefs,
+            plan.remote_hrefs,
+        ),
+        (
+            "repository",
+            referenced_repositories - declared("repositories"),
+            repository_hrefs,
+            plan.repository_hrefs,
+        ),
+    ]
+    for kind, names, resolve, known in lookups:
+        if not names:
+            continue
+        found = resolve(sorted(names))
+        missing = names - set(found)
+        if missing:
+            raise ValueError(
+                f"Unknown {kind} referenced by the manifest: "
+                + ", ".join(sorted(missing))
+            )
+        known.update(found)
+
+
+_PLANNERS = {
+    "remotes": _plan_remotes,
+    "groups": _plan_groups,
+    "roles": _plan_roles,
+    "users": _plan_users,
+    "namespaces": _plan_namespaces,
+    "repositories": _plan_repositories,
+    "distributions": _plan_distributions,
+}
+
+
+def plan(client, manifest):
+    """
+    Compares the manifest (as returned by `load`) with the server, reading
+    the current state once per kind, and returns the Plan bringing the
+    server in line with it. Objects the manifest refers to must either be
+    listed in it or exist already, ValueError is raised otherwise.
+    """
+    result = Plan()
+    _resolve_references(client, result, manifest)
+    for kind in KINDS:
+        if manifest.get(kind):
+            _PLANNERS[kind](client, result, manifest[kind])
+    return result
+
+
+def apply_plan(client, plan, max_workers=8):
+    """
+    Runs the steps of the plan layer by layer, the steps of a layer
+    concurrently. If any step fails, the following layers are skipped.
+    Returns the failed steps.
+    """
+    for index, layer in enumerate(plan.layers):
+        for step, _, error in run_bounded(lambda step: step.run(), layer, max_workers):
+            if error is None:
+                step.status = "done"
+                logger.info(f"Applied {step}")
+            else:
+                step.status = "failed"
+                step.error = str(error)
+                logger.error(f"Failed {step}")
+        if plan.failed():
+            for step in [s for layer in plan.layers[index + 1 :] for s in layer]:
+                step.status = "skipped"
+            break
+    return plan.failed()
+
+
+def apply(client, manifest, dry_run=False, max_workers=8):
+    """Plans the manifest and, unless dry_run, applies it. Returns the Plan."""
+    result = plan(client, manifest)
+    if not dry_run:
+        apply_plan(client, result, max_workers)
+    return result
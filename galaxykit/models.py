@@ -0,0 +1,182 @@
+"""
+Compact, read-only views of the objects returned by large listings.
+
+A record keeps the commonly used scalar fields in `__slots__`, and the nested
+structures packed together as compressed JSON, only decoded when one of them
+is accessed. Holding many thousands of records takes a fraction of the memory
+of the decoded dicts.
+
+Records can be read both as objects and as dicts:
+
+    entry.collection_version["pulp_href"]
+    entry["collection_version"]["pulp_href"]
+"""
+
+import zlib
+
+from . import codec
+
+
+class _Nested:
+    """Decodes a nested field out of the packed ones on each access."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return obj._unpack().get(self.name)
+
+
+class Record:
+    """
+    Base class of the records. Subclasses list their scalar fields in
+    `__slots__` and their nested fields in `nested`.
+    """
+
+    __slots__ = ("_packed",)
+    nested = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(
+            slot
+            for klass in reversed(cls.__mro__)
+            for slot in getattr(klass, "__slots__", ())
+            if not slot.startswith("_")
+        )
+        for name in cls.nested:
+            setattr(cls, name, _Nested(name))
+
+    @classmethod
+    def api_fields(cls):
+        """Returns the API fields the record is built from, for projection."""
+        return cls._fields + cls.nested
+
+    @classmethod
+    def _values(cls, data):
+        """Returns the scalar field values to keep out of an API object."""
+        return {name: data.get(name) for name in cls._fields}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for name, value in cls._values(data).items():
+            setattr(record, name, value)
+        nested = {name: data[name] for name in cls.nested if name in data}
+        record._packed = zlib.compress(codec.dumps(nested), 1) if nested else None
+        return record
+
+    def _unpack(self):
+        if self._packed is None:
+            return {}
+        return codec.loads(zlib.decompress(self._packed))
+
+    def to_dict(self):
+        """Returns the fields and the decoded nested fields as a dict."""
+        data = {name: getattr(self, name) for name in self._fields}
+        data.update(self._unpack())
+        return data
+
+    def __getitem__(self, key):
+        if key in self._fields or key in self.nested:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+
+class CollectionVersionEntry(Record):
+    """An entry of v3/plugin/ansible/search/collection-versions/."""
+
+    __slots__ = (
+        "namespace",
+        "name",
+        "version",
+        "pulp_href",
+        "sha256",
+        "repository_name",
+        "is_highest",
+        "is_deprecated",
+        "is_signed",
+    )
+    nested = ("collection_version", "repository", "namespace_metadata")
+
+    @classmethod
+    def _values(cls, data):
+        cv = data.get("collection_version") or {}
+        return {
+            "namespace": cv.get("namespace"),
+            "name": cv.get("name"),
+            "version": cv.get("version"),
+            "pulp_href": cv.get("pulp_href"),
+            "sha256": cv.get("sha256"),
+            "repository_name": (data.get("repository") or {}).get("name"),
+            "is_highest": data.get("is_highest"),
+            "is_deprecated": data.get("is_deprecated"),
+            "is_signed": data.get("is_signed"),
+        }
+
+
+class Task(Record):
+    """A pulp task, from pulp/api/v3/tasks/."""
+
+    __slots__ = (
+        "pulp_href",
+        "name",
+        "state",
+        "pulp_created",
+        "started_at",
+        "finished_at",
+        "created_resources",
+    )
+    nested = ("error", "progress_reports")
+
+    @classmethod
+    def _values(cls, data):
+        values = super()._values(data)
+        values["created_resources"] = tuple(data.get("created_resources") or ())
+        return values
+
+
+class User(Record):
+    """A user, from _ui/v1/users/."""
+
+    __slots__ = (
+        "id",
+        "username",
+        "first_name",
+        "last_name",
+        "email",
+        "is_superuser",
+    )
+    nested = ("groups",)
+
+
+class Group(Record):
+    """A group, from _ui/v1/groups/ or pulp/api/v3/groups/."""
+
+    __slots__ = ("id", "name", "pulp_href")
+
+
+class Repository(Record):
+    """An ansible repository, from pulp/api/v3/repositories/ansible/ansible/."""
+
+    __slots__ = (
+        "pulp_href",
+        "name",
+        "description",
+        "latest_version_href",
+        "remote",
+        "private",
+    )
+    nested = ("pulp_labels",)
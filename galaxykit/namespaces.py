@@ -1,32 +1,50 @@
 from . import groups
-from .utils import logger
+from . import repositories
+from . import utils
+from .concurrency import run_bounded
+from .utils import TaskFailed, logger
 from .collections import delete_collection
 
 
+def _post_namespace(client, name, group, object_roles):
+    ns_groups = []
+    object_roles = [] if object_roles is None else object_roles
+    if group:
+        group_id = groups.get_group_id(client, group)
+        _group = {
+            "id": group_id,
+            "name": group,
+            "object_permissions": ["change_namespace", "upload_to_namespace"],
+        }
+        if client.rbac_enabled:
+            _group["object_roles"] = object_roles
+        ns_groups.append(_group)
+    create_body = {"name": name, "groups": ns_groups}
+    logger.debug(f"Creating namespace {name}. Request body {create_body}")
+    return client.post("v3/namespaces/", create_body)
+
+
 def create_namespace(client, name, group, object_roles=None):
     try:
         get_namespace(client, name)
     except KeyError:
-        ns_groups = []
-        object_roles = [] if object_roles is None else object_roles
-        if group:
-            group_id = groups.get_group_id(client, group)
-            _group = {
-                "id": group_id,
-                "name": group,
-                "object_permissions": ["change_namespace", "upload_to_namespace"],
-            }
-            if client.rbac_enabled:
-                _group["object_roles"] = object_roles
-            ns_groups.append(_group)
-        create_body = {"name": name, "groups": ns_groups}
-        logger.debug(f"Creating namespace {name}. Request body {create_body}")
-        return client.post("v3/namespaces/", create_body)
+        return _post_namespace(client, name, group, object_roles)
     else:
         if group:
             add_group(client, name, group, object_roles)
 
 
+def ensure_namespace(client, name, group=None, object_roles=None):
+    """
+    Creates the namespace, owned by group if given, unless it already
+    exists. Returns a "created" flag and the namespace.
+    """
+    return utils.ensure(
+        lambda: _post_namespace(client, name, group, object_roles),
+        lambda: get_namespace(client, name),
+    )
+
+
 def get_namespace(client, name):
     try:
         namespace = client.get(f"v3/namespaces/{name}/")
@@ -104,29 +122,95 @@ def delete_v1_namespace(client, name):
     return client.delete(delete_url, parse_json=False)
 
 
-def delete_namespace(client, name, cascade=False):
+def delete_namespace_collections(
+    client, name, max_workers=8, on_progress=None, timeout=3600
+):
     """
-    Delete namespace
+    Deletes every collection of the namespace from all the repositories.
+    Up to max_workers deletes are sent at a time, and their tasks are all
+    waited for together. `on_progress(done, total, entry)` is called as each
+    collection is dealt with.
+
+    Returns a report with one entry per collection deleted:
+    {"repository", "namespace", "name", "task", "state", "error"}
+    """
+    entries = {}
+    for cv in repositories.iter_search_collection(
+        client, records=True, namespace=name, is_highest="true"
+    ):
+        key = (cv.repository_name, cv.namespace, cv.name)
+        entries.setdefault(
+            key,
+            {
+                "repository": cv.repository_name,
+                "namespace": cv.namespace,
+                "name": cv.name,
+                "task": None,
+                "state": None,
+                "error": None,
+            },
+        )
+    report = list(entries.values())
+    done = 0
+
+    def progress(entry):
+        nonlocal done
+        done += 1
+        collection = f"{entry['namespace']}.{entry['name']} in {entry['repository']}"
+        if entry["error"] is None:
+            logger.info(f"Deleted {collection} ({done}/{len(report)})")
+        else:
+            logger.warning(f"Failed to delete {collection}: {entry['error']}")
+        if on_progress is not None:
+            on_progress(done, len(report), entry)
+
+    def send_delete(entry):
+        return delete_collection(
+            client,
+            entry["namespace"],
+            entry["name"],
+            repository=entry["repository"],
+            wait=False,
+        )
+
+    def sent(entry, resp, error):
+        if error is not None:
+            entry["state"] = "failed"
+            entry["error"] = str(error)
+            progress(entry)
+        else:
+            entry["task"] = resp["task"]
+
+    def finished(task):
+        entry = by_task[task["pulp_href"]]
+        entry["state"] = task["state"]
+        if task["state"] != "completed":
+            entry["error"] = task["error"] or task["state"]
+        progress(entry)
+
+    run_bounded(send_delete, report, max_workers, on_done=sent)
+    by_task = {entry["task"]: entry for entry in report if entry["task"]}
+    utils.wait_for_tasks(client, by_task, timeout=timeout, on_finished=finished)
+    return report
+
+
+def delete_namespace(client, name, cascade=False, max_workers=8, on_progress=None):
+    """
+    Delete namespace. With cascade=True, its collections are deleted from all
+    the repositories first (see delete_namespace_collections), and TaskFailed
+    is raised, keeping the namespace, if any of them couldn't be.
     """
 
     if cascade:
-        # find all collections first ...
-        collections = set()
-        next_url = f"v3/plugin/ansible/search/collection-versions/?namespace={name}&is_highest=true"
-        while next_url:
-            resp = client.get(next_url)
-            for collection in resp["data"]:
-                collections.add((
-                    collection["repository"]["name"],
-                    collection["collection_version"]["namespace"],
-                    collection["collection_version"]["name"],
-                ))
-            if resp["links"]["next"] is None:
-                break
-            next_url = resp["links"]["next"]
-
-        for collection in collections:
-            delete_collection(client, collection[1], collection[2], repository=collection[0])
+        report = delete_namespace_collections(client, name, max_workers, on_progress)
+        failed = [entry for entry in report if entry["error"] is not None]
+        if failed:
+            raise TaskFailed(
+                f"Failed to delete {len(failed)} collections of namespace {name}: "
+                + ", ".join(
+                    f"{entry['name']} in {entry['repository']}" for entry in failed
+                )
+            )
 
     delete_url = f"_ui/v1/namespaces/{name}"
     return client.delete(delete_url, parse_json=False)
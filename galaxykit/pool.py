@@ -0,0 +1,140 @@
+"""
+A pool of per-user GalaxyClient objects sharing a single HTTP transport.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .client import GalaxyClient, build_session
+
+logger = logging.getLogger(__name__)
+
+
+def _auth_key(auth):
+    """Returns a hashable identity for the given client credentials."""
+    if isinstance(auth, dict):
+        return tuple(sorted(auth.items()))
+    return tuple(auth)
+
+
+class ClientPool:
+    """
+    Hands out one GalaxyClient per set of credentials, all of them talking to
+    the same galaxy_root over one shared connection pool and one shared server
+    capability cache (server version, RBAC support, ...).
+
+    Authentication is never shared: each client keeps its own headers and the
+    shared session refuses to store cookies.
+
+    The pool is bounded. Once `max_clients` user contexts are held, the least
+    recently used one is evicted, and contexts unused for `idle_timeout`
+    seconds are dropped whenever the pool is accessed.
+
+    pool = ClientPool("http://localhost:8002/api/automation-hub/")
+    admin = pool.get(("admin", "admin"))
+    basic = pool.get({"username": "basic_user", "password": "secret"})
+    """
+
+    def __init__(
+        self,
+        galaxy_root,
+        max_clients=32,
+        idle_timeout=300,
+        session=None,
+        **client_kwargs,
+    ):
+        """
+        Any extra keyword argument is passed to every GalaxyClient created by
+        the pool (https_verify, token_type, ...).
+        """
+        self.galaxy_root = galaxy_root
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self._owns_session = session is None
+        self.session = session or build_session(pool_maxsize=max_clients)
+        self.capabilities = {}
+        self._client_kwargs = client_kwargs
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._evicted = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, auth):
+        """
+        Returns the client for the given credentials, logging in a new one
+        if the pool doesn't hold it yet.
+        """
+        key = _auth_key(auth)
+        with self._lock:
+            self._evict_idle()
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                entry[1] = time.monotonic()
+                return entry[0]
+
+        # log in outside the lock, so one slow login doesn't block other users
+        client = GalaxyClient(
+            self.galaxy_root,
+            auth,
+            session=self.session,
+            capabilities=self.capabilities,
+            **self._client_kwargs,
+        )
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = [client, time.monotonic()]
+                self._clients[key] = entry
+                self._created += 1
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+                    self._evicted += 1
+            self._clients.move_to_end(key)
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def evict(self, auth):
+        """Drops the client for the given credentials, if any."""
+        with self._lock:
+            if self._clients.pop(_auth_key(auth), None) is not None:
+                self._evicted += 1
+
+    def evict_idle(self):
+        """Drops every client unused for longer than `idle_timeout` seconds."""
+        with self._lock:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        if self.idle_timeout is None:
+            return
+        expired = time.monotonic() - self.idle_timeout
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if last_used > expired:
+                break
+            logger.debug("Evicting idle client context.")
+            del self._clients[key]
+            self._evicted += 1
+
+    def clear(self):
+        """Drops all clients and closes the session if the pool created it."""
+        with self._lock:
+            self._evicted += len(self._clients)
+            self._clients.clear()
+        if self._owns_session:
+            self.session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "created": self._created,
+                "evicted": self._evicted,
+            }
@@ -40,14 +40,24 @@ def get_remote_href(client, name):
     """
     Returns the href for a given remote name
     """
-    user_url = f"pulp/api/v3/remotes/ansible/collection/?name={name}"
-    resp = client.get(user_url)
+    user_url = utils.merge_query(
+        "pulp/api/v3/remotes/ansible/collection/", name=name, limit=1
+    )
+    resp = client.get(user_url, fields=["pulp_href"])
     if resp["results"] and resp["results"][0]:
         return resp["results"][0]["pulp_href"]
     else:
         raise ValueError(f"No remote '{name}' found.")
 
 
+def resolve_remotes(client, names, fields=None):
+    """
+    Returns the collection remotes with the given names, keyed by name.
+    """
+    url = "pulp/api/v3/remotes/ansible/collection/"
+    return utils.resolve_in(client, url, "name__in", names, "name", fields)
+
+
 def delete_remote(client, name):
     """
     Delete remote
@@ -77,6 +87,17 @@ def create_remote(
     return client.post(remote_url, body)
 
 
+def ensure_remote(client, name, url, **kwargs):
+    """
+    Creates the remote unless it already exists, kwargs are passed to
+    create_remote. Returns a "created" flag and the remote.
+    """
+    return utils.ensure(
+        lambda: create_remote(client, name, url, **kwargs),
+        lambda: view_remotes(client, name)["results"][0],
+    )
+
+
 def view_remotes(client, name=None):
     remote_url = f"pulp/api/v3/remotes/ansible/collection/?name={name}"
     return client.get(remote_url)
@@ -1,7 +1,14 @@
+import sys
+import time
+from collections import namedtuple
+
+from . import models
 from . import remotes
 from . import utils
-from galaxykit.utils import wait_for_task
-from urllib.parse import urljoin
+from .concurrency import run_bounded
+from .constants import CONTENT_BATCH_SIZE
+from galaxykit.utils import TaskFailed, TaskWaitingTimeout, wait_for_task
+from urllib.parse import urlencode, urljoin
 
 
 def get_repository_pk(client, name):
@@ -15,8 +22,10 @@ def get_repository_href(client, name):
     """
     Returns the href for a given repository name
     """
-    user_url = f"pulp/api/v3/repositories/ansible/ansible/?name={name}"
-    resp = client.get(user_url)
+    user_url = utils.merge_query(
+        "pulp/api/v3/repositories/ansible/ansible/", name=name, limit=1
+    )
+    resp = client.get(user_url, fields=["pulp_href"])
     if resp["results"] and resp["results"][0]:
         href = resp["results"][0]["pulp_href"]
         return href
@@ -24,6 +33,26 @@ def get_repository_href(client, name):
         raise ValueError(f"No remote '{name}' found.")
 
 
+def resolve_repositories(client, names, fields=None):
+    """
+    Returns the ansible repositories with the given names, keyed by name.
+    """
+    url = "pulp/api/v3/repositories/ansible/ansible/"
+    return utils.resolve_in(client, url, "name__in", names, "name", fields)
+
+
+def resolve_repository_hrefs(client, names):
+    """
+    Returns the hrefs of the given repositories, keyed by name. Raises
+    ValueError if any of them doesn't exist.
+    """
+    repos = resolve_repositories(client, names, fields=["pulp_href"])
+    missing = [name for name in names if name not in repos]
+    if missing:
+        raise ValueError(f"No repositories {missing} found.")
+    return {name: repo["pulp_href"] for name, repo in repos.items()}
+
+
 def delete_repository(client, name):
     """
     Delete repository
@@ -44,7 +73,8 @@ def create_repository(
     hide_from_search=False,
 ):
     """
-    Create repository
+    Create repository. `remote` is the name or the href of its remote.
+    Returns the new repository.
     """
     post_url = f"pulp/api/v3/repositories/ansible/ansible/"
 
@@ -60,12 +90,25 @@ def create_repository(
         registry["pulp_labels"] = {"pipeline": pipeline}
 
     if remote:
-        pk = remotes.get_remote_href(client, remote)
-        registry["remote"] = pk
+        if remote.startswith("/"):
+            registry["remote"] = remote
+        else:
+            registry["remote"] = remotes.get_remote_href(client, remote)
 
     return client.post(post_url, registry)
 
 
+def ensure_repository(client, name, **kwargs):
+    """
+    Creates the repository unless it already exists, kwargs are passed to
+    create_repository. Returns a "created" flag and the repository.
+    """
+    return utils.ensure(
+        lambda: create_repository(client, name, **kwargs),
+        lambda: view_repositories(client, name)["results"][0],
+    )
+
+
 def patch_update_repository(client, repository_id, update_body):
     update_repo_url = f"pulp/api/v3/repositories/ansible/ansible/{repository_id}/"
     return client.patch(update_repo_url, update_body)
@@ -76,16 +119,50 @@ def put_update_repository(client, repository_id, update_body):
     return client.put(update_repo_url, update_body)
 
 
+def _search_url(search_param):
+    """
+    Returns the collection version search url. Values are URL encoded, and
+    lists are sent as repeated parameters (repository_name=a&repository_name=b).
+    """
+    query = urlencode(search_param, doseq=True, safe=",/")
+    return f"v3/plugin/ansible/search/collection-versions/?{query}"
+
+
 def search_collection(client, **search_param):
-    search_url = "v3/plugin/ansible/search/collection-versions/?"
-    for key, value in search_param.items():
-        if isinstance(value, list):
-            param = "&".join([f"{key}={v}" for v in value])
-        else:
-            param = f"{key}={value}"
-        search_url += f"{param}&"
-    search_url = search_url[:-1]
-    return client.get(search_url)
+    """
+    Returns a single page of the collection version search. `limit` and
+    `offset` pick the page, `order_by` sorts the results.
+    """
+    return client.get(_search_url(search_param), hedge=True)
+
+
+def iter_search_collection(
+    client,
+    records=False,
+    prefetch=0,
+    order_by=None,
+    fields=None,
+    exclude_fields=None,
+    **search_param,
+):
+    """
+    Yields every collection version matching the search, following the
+    pagination. With records=True, yields models.CollectionVersionEntry
+    records, which take far less memory than the dicts when kept around.
+
+    `prefetch` pages are requested ahead of the one being read, from other
+    threads. `order_by` is a field or a list of fields, prefixed with "-" for
+    a descending order, and `fields`/`exclude_fields` select the fields
+    returned. The search starts at `offset` if given.
+    """
+    search_param.setdefault("limit", 100)
+    if isinstance(order_by, (list, tuple)):
+        order_by = ",".join(order_by)
+    if order_by:
+        search_param["order_by"] = order_by
+    url = utils.project_fields(_search_url(search_param), fields, exclude_fields)
+    record = models.CollectionVersionEntry if records else None
+    return utils.iter_results(client, url, record, prefetch)
 
 
 def get_all_repositories(client):
@@ -96,36 +173,296 @@ def get_all_repositories(client):
     return client.get(url)["results"]
 
 
+def iter_repositories(client, records=False):
+    """
+    Yields every ansible repository, as models.Repository records with
+    records=True.
+    """
+    url = "pulp/api/v3/repositories/ansible/ansible/?limit=100"
+    if not records:
+        return utils.iter_results(client, url)
+    url = utils.project_fields(url, models.Repository.api_fields())
+    return utils.iter_results(client, url, models.Repository)
+
+
 def get_distribution_id(client, name):
-    ansible_distribution_path = (
-        f"pulp/api/v3/distributions/ansible/ansible/?name={name}"
+    ansible_distribution_path = utils.merge_query(
+        "pulp/api/v3/distributions/ansible/ansible/", name=name, limit=1
     )
-    resp = client.get(ansible_distribution_path)
+    resp = client.get(ansible_distribution_path, fields=["pulp_href"])
     return resp["results"][0]["pulp_href"].split("/")[-2]
 
 
+def _transfer_content(
+    client,
+    operation,
+    cv_hrefs,
+    source_repo_href,
+    destination_repo_hrefs,
+    batch_size,
+    max_workers,
+    cursor,
+    on_batch,
+    timeout,
+    raise_on_error,
+):
+    url = urljoin(source_repo_href, f"{operation}_collection_version/")
+    cv_hrefs = list(cv_hrefs)
+    batch_size = batch_size or CONTENT_BATCH_SIZE
+    batches = [
+        {
+            "index": index,
+            "hrefs": cv_hrefs[start : start + batch_size],
+            "task": None,
+            "state": None,
+            "error": None,
+            "elapsed": None,
+        }
+        for index, start in enumerate(range(0, len(cv_hrefs), batch_size))
+    ]
+    report = {"batches": [], "completed": 0, "failed": 0, "cursor": cursor}
+    started = time.monotonic()
+
+    def submit(batch):
+        batch["started"] = time.monotonic()
+        body = {
+            "collection_versions": batch["hrefs"],
+            "destination_repositories": destination_repo_hrefs,
+        }
+        return client.post(url, body)["task"]
+
+    def end(batch, state, error=None):
+        batch["state"] = state
+        batch["error"] = error
+        batch["elapsed"] = time.monotonic() - batch.pop("started")
+        report["completed" if state == "completed" else "failed"] += 1
+        if on_batch is not None:
+            on_batch(batch)
+
+    def submitted(batch, task, error):
+        if error is not None:
+            end(batch, "failed", str(error))
+        else:
+            batch["task"] = task
+            by_task[task] = batch
+
+    def finished(task):
+        error = None
+        if task["state"] != "completed":
+            error = str(task["error"] or task["state"])
+        end(by_task[task["pulp_href"]], task["state"], error)
+
+    # a window of batches is sent at a time, the cursor moves past a window
+    # once all its batches are done
+    for start in range(cursor, len(batches), max_workers):
+        window = batches[start : start + max_workers]
+        by_task = {}
+        run_bounded(submit, window, max_workers, on_done=submitted)
+        try:
+            utils.wait_for_tasks(client, by_task, timeout=timeout, on_finished=finished)
+        except TaskWaitingTimeout as e:
+            # the tasks left may still complete, the cursor stays on the window
+            for batch in window:
+                if batch["state"] is None:
+                    end(batch, "timeout", str(e) or "Timed out waiting for the task")
+            report["batches"].extend(window)
+            report["elapsed"] = time.monotonic() - started
+            e.report = report
+            raise
+        report["batches"].extend(window)
+        if any(batch["state"] != "completed" for batch in window):
+            break
+        report["cursor"] = start + len(window)
+
+    report["elapsed"] = time.monotonic() - started
+    if raise_on_error and report["failed"]:
+        error = TaskFailed(
+            f"{report['failed']} of {len(report['batches'])} batches failed "
+            f"to {operation}, resume from cursor {report['cursor']}"
+        )
+        error.report = report
+        raise error
+    return report
+
+
 def copy_content_between_repos(
-    client, cv_hrefs, source_repo_href, destination_repo_hrefs
+    client,
+    cv_hrefs,
+    source_repo_href,
+    destination_repo_hrefs,
+    batch_size=None,
+    max_workers=4,
+    cursor=0,
+    on_batch=None,
+    timeout=3600,
+    raise_on_error=True,
 ):
-    url = urljoin(source_repo_href, "copy_collection_version/")
-    body = {
-        "collection_versions": cv_hrefs,
-        "destination_repositories": destination_repo_hrefs,
-    }
-    r = client.post(url, body)
-    return wait_for_task(client, r)
+    """
+    Copies the collection versions to the destination repositories, in
+    batches of batch_size (CONTENT_BATCH_SIZE by default), each one its own
+    task. Up to max_workers batches are sent at a time and their tasks are
+    waited for together. `on_batch(batch)` is called as each batch ends.
+
+    Stops after the first window of batches with a failure and raises
+    TaskFailed, or returns the report with raise_on_error=False. Timing out
+    waiting for a window raises TaskWaitingTimeout, its batches still
+    running being reported as "timeout". Either error carries the report
+    as its `report` attribute. The report's "cursor" is the index of the
+    first batch not known to be done: calling again with the same hrefs and
+    batch size and cursor=report["cursor"] resumes from there.
+
+    Returns {"batches", "completed", "failed", "cursor", "elapsed"}, each
+    batch being {"index", "hrefs", "task", "state", "error", "elapsed"},
+    error being a message.
+    """
+    return _transfer_content(
+        client,
+        "copy",
+        cv_hrefs,
+        source_repo_href,
+        destination_repo_hrefs,
+        batch_size,
+        max_workers,
+        cursor,
+        on_batch,
+        timeout,
+        raise_on_error,
+    )
 
 
 def move_content_between_repos(
-    client, cv_hrefs, source_repo_href, destination_repo_hrefs
+    client,
+    cv_hrefs,
+    source_repo_href,
+    destination_repo_hrefs,
+    batch_size=None,
+    max_workers=4,
+    cursor=0,
+    on_batch=None,
+    timeout=3600,
+    raise_on_error=True,
 ):
-    url = urljoin(source_repo_href, "move_collection_version/")
-    body = {
-        "collection_versions": cv_hrefs,
-        "destination_repositories": destination_repo_hrefs,
+    """
+    Moves the collection versions to the destination repositories, in
+    batches, see copy_content_between_repos.
+    """
+    return _transfer_content(
+        client,
+        "move",
+        cv_hrefs,
+        source_repo_href,
+        destination_repo_hrefs,
+        batch_size,
+        max_workers,
+        cursor,
+        on_batch,
+        timeout,
+        raise_on_error,
+    )
+
+
+# a collection version of a repository, as indexed by diff_repositories
+ContentEntry = namedtuple(
+    "ContentEntry", ["namespace", "name", "version", "sha256", "pulp_href"]
+)
+
+
+def iter_repository_content(client, name, prefetch=2):
+    """
+    Yields a ContentEntry for every collection version in the repository.
+    """
+    for entry in iter_search_collection(
+        client, prefetch=prefetch, repository_name=name
+    ):
+        cv = entry["collection_version"]
+        yield ContentEntry(
+            sys.intern(cv["namespace"]),
+            sys.intern(cv["name"]),
+            cv["version"],
+            cv.get("sha256"),
+            cv["pulp_href"],
+        )
+
+
+class RepositoryDiff:
+    """
+    The collection versions only in the source repository (added), only in
+    the destination one (removed), and in both with different contents
+    (changed, as (source, destination) pairs of ContentEntry).
+    """
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def hrefs(self, changed=False):
+        """
+        Returns the hrefs of the source collection versions missing from the
+        destination, including those that differ with changed=True.
+        """
+        hrefs = [entry.pulp_href for entry in self.added]
+        if changed:
+            hrefs.extend(source.pulp_href for source, _ in self.changed)
+        return hrefs
+
+    def __str__(self):
+        lines = [f"+ {e.namespace}.{e.name}:{e.version}" for e in self.added]
+        lines += [f"- {e.namespace}.{e.name}:{e.version}" for e in self.removed]
+        lines += [f"~ {e.namespace}.{e.name}:{e.version}" for e, _ in self.changed]
+        return "\n".join(lines)
+
+
+def diff_repositories(client, source, destination, prefetch=2):
+    """
+    Compares the collection versions of two repositories, by name. The
+    destination is indexed by (namespace, name, version), keeping only its
+    sha256 and href, then the source is streamed against that index.
+    Returns a RepositoryDiff.
+
+    The result feeds apply_repository_diff, or directly
+    copy_content_between_repos / move_content_between_repos through
+    RepositoryDiff.hrefs().
+    """
+    index = {
+        (entry.namespace, entry.name, entry.version): entry
+        for entry in iter_repository_content(client, destination, prefetch)
     }
-    r = client.post(url, body)
-    return wait_for_task(client, r)
+    diff = RepositoryDiff(source, destination)
+    for entry in iter_repository_content(client, source, prefetch):
+        other = index.pop((entry.namespace, entry.name, entry.version), None)
+        if other is None:
+            diff.added.append(entry)
+        elif (entry.sha256 or entry.pulp_href) != (other.sha256 or other.pulp_href):
+            diff.changed.append((entry, other))
+    diff.removed = list(index.values())
+    return diff
+
+
+def apply_repository_diff(client, diff, operation="copy", changed=False, **kwargs):
+    """
+    Copies (or moves) the collection versions missing from the destination
+    of the diff from its source, and the changed ones too with changed=True.
+    kwargs are passed on to copy_content_between_repos, see its report and
+    errors.
+    Returns None when there's nothing to do.
+    """
+    hrefs = diff.hrefs(changed)
+    if not hrefs:
+        return None
+    repos = resolve_repository_hrefs(client, [diff.source, diff.destination])
+    transfer = {
+        "copy": copy_content_between_repos,
+        "move": move_content_between_repos,
+    }[operation]
+    return transfer(
+        client, hrefs, repos[diff.source], [repos[diff.destination]], **kwargs
+    )
 
 
 def view_repositories(client, name=None):
@@ -145,12 +482,26 @@ def add_permissions_to_repository(client, name, role, groups):
     return client.post(pulp_href + "add_role/", body)
 
 
-def create_distribution(client, dist_name, repo_href):
+def add_permissions_to_repositories(client, names, role, groups):
+    """
+    Grants role to groups on each of the named repositories, resolving all
+    the repositories in one lookup.
+    """
+    hrefs = resolve_repository_hrefs(client, names)
+    body = {"role": role, "groups": groups}
+    return [client.post(hrefs[name] + "add_role/", body) for name in names]
+
+
+def create_distribution(client, dist_name, repo_href, hydrate=False):
+    """
+    Creates a distribution for the repository and waits for it. Returns
+    repo_href, or with hydrate=True the new distribution.
+    """
     ansible_distribution_path = "pulp/api/v3/distributions/ansible/ansible/"
     dist_data = {"base_path": dist_name, "name": dist_name, "repository": repo_href}
     task_resp = client.post(ansible_distribution_path, dist_data)
-    wait_for_task(client, task_resp)
-    return repo_href
+    created = utils.wait_for_created(client, task_resp, hydrate=hydrate)
+    return created[0] if hydrate else repo_href
 
 
 def delete_distribution(client, dist_name):
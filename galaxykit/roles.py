@@ -20,14 +20,22 @@ def get_role_id(client, role_name):
     """
     Returns the id for a given role
     """
-    roles_url = f"pulp/api/v3/roles/?name={role_name}"
-    resp = client.get(roles_url)
+    roles_url = utils.merge_query("pulp/api/v3/roles/", name=role_name, limit=1)
+    resp = client.get(roles_url, fields=["pulp_href"])
     if resp["results"]:
         return utils.pulp_href_to_id(resp["results"][0]["pulp_href"])
     else:
         raise ValueError(f"No role '{role_name}' found.")
 
 
+def resolve_roles(client, role_names, fields=None):
+    """
+    Returns the roles with the given names, keyed by name.
+    """
+    url = "pulp/api/v3/roles/"
+    return utils.resolve_in(client, url, "name__in", role_names, "name", fields)
+
+
 def create_role(client, role_name, description, permissions):
     """
     Creates an rbac role
@@ -43,6 +51,22 @@ def create_role(client, role_name, description, permissions):
     return resp
 
 
+def ensure_role(client, role_name, description, permissions):
+    """
+    Creates the rbac role unless it already exists. Returns a "created" flag
+    and the role.
+    """
+    payload = {
+        "description": description,
+        "name": role_name,
+        "permissions": permissions or [],
+    }
+    return utils.ensure(
+        lambda: client.post("pulp/api/v3/roles/", payload),
+        lambda: get_role(client, role_name),
+    )
+
+
 def patch_update_role(client, role_name, updated_body):
     """
     Updates a role. It can be partially updated.
@@ -102,3 +126,27 @@ def set_permissions(client, role_name, add_permissions=[], remove_permissions=[]
     if resp.status_code == 400:
         raise ValueError(resp.json())
     return resp
+
+
+def sync_role_permissions(client, role_name, permissions, remove=True, dry_run=False):
+    """
+    Makes the role have exactly the given permissions (or at least them, with
+    remove=False), reading the role once and sending a single PATCH, only if
+    anything changes. With dry_run=True, nothing is changed.
+
+    Returns a report of the changes: {"role", "added", "removed", "unchanged"}
+    """
+    role = get_role(client, role_name)
+    current = set(role["permissions"])
+    desired = set(permissions)
+    removed = current - desired if remove else set()
+    report = {
+        "role": role_name,
+        "added": sorted(desired - current),
+        "removed": sorted(removed),
+        "unchanged": sorted(desired & current),
+    }
+    if (report["added"] or report["removed"]) and not dry_run:
+        payload = {"permissions": sorted((current | desired) - removed)}
+        client.patch(role["pulp_href"], payload)
+    return report
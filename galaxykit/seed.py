@@ -0,0 +1,269 @@
+"""
+Seeding of large synthetic datasets, `galaxykit seed`.
+
+The dataset is N namespaces of M collections of K versions each, named
+from a prefix (`seed_ns0.seed_c0:1.0.0`...). Every version is built with
+orionutils, uploaded, optionally signed, then copied or moved to one of the
+given repositories, the collections being spread over them in turn.
+
+Each step completed is appended to a local journal, a file of JSON lines.
+Running again with the same journal skips what it records, so a run that
+failed or was interrupted resumes where it stopped. A step whose effect is
+already there, while missing from the journal, isn't done twice either.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import collections
+from . import namespaces
+from . import repositories
+from . import utils
+from .concurrency import run_bounded
+from .utils import GalaxyClientError, logger
+
+# orionutils builds every collection in the same checkout directory
+_build_lock = threading.Lock()
+
+
+class Journal:
+    """Append-only record of the steps completed, kept in a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["step"])
+                    except (ValueError, KeyError):
+                        # a line cut short by an interruption
+                        continue
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __contains__(self, step):
+        return step in self.done
+
+    def record(self, step):
+        with self._lock:
+            self._file.write(json.dumps({"step": step, "at": time.time()}) + "\n")
+            self._file.flush()
+            self.done.add(step)
+
+    def close(self):
+        self._file.close()
+
+
+def dataset(prefix, namespace_count, collection_count, version_count):
+    """
+    Returns the collections to seed as (namespace, name, [versions]) tuples.
+    """
+    return [
+        (
+            f"{prefix}_ns{i}",
+            f"{prefix}_c{j}",
+            [f"1.{k}.0" for k in range(version_count)],
+        )
+        for i in range(namespace_count)
+        for j in range(collection_count)
+    ]
+
+
+def _build(namespace, name, version, tags, workdir):
+    with _build_lock:
+        artifact = collections.create_test_collection(
+            namespace, name, version, list(tags)
+        )
+        filename = os.path.join(workdir, os.path.basename(artifact.filename))
+        shutil.copy(artifact.filename, filename)
+    artifact.filename = filename
+    return artifact
+
+
+def _exists(client, repository, namespace, name, version):
+    try:
+        collections.collection_info(client, repository, namespace, name, version)
+        return True
+    except GalaxyClientError as e:
+        if e.status_code == 404:
+            return False
+        raise
+
+
+def _upload(client, namespace, name, version, upload_to, tags, workdir):
+    if _exists(client, upload_to, namespace, name, version):
+        return
+    artifact = _build(namespace, name, version, tags, workdir)
+    try:
+        resp = collections.upload_artifact(None, client, artifact, path=upload_to)
+    finally:
+        os.remove(artifact.filename)
+    utils.wait_for_task(client, resp, raise_on_error=True)
+
+
+def _signed(client, repository, namespace, name, version):
+    found = repositories.iter_search_collection(
+        client,
+        repository_name=repository,
+        namespace=namespace,
+        name=name,
+        version=version,
+        limit=1,
+    )
+    return any(cv["is_signed"] for cv in found)
+
+
+def _sign(client, namespace, name, version, repository, repo_href):
+    if _signed(client, repository, namespace, name, version):
+        return
+    url = utils.merge_query(
+        "pulp/api/v3/content/ansible/collection_versions/",
+        namespace=namespace,
+        name=name,
+        version=version,
+        fields=["pulp_href"],
+    )
+    cv_href = client.get(url)["results"][0]["pulp_href"]
+    collections.sign_collection(client, cv_href, repo_href)
+
+
+def _spread(client, namespace, name, version, source, destination, operation):
+    if _exists(client, destination, namespace, name, version):
+        return
+    collections.move_or_copy_collection(
+        client, namespace, name, version, source, destination, operation
+    )
+
+
+def seed(
+    client,
+    journal_path,
+    prefix="seed",
+    namespace_count=10,
+    collection_count=10,
+    version_count=3,
+    upload_to="published",
+    destinations=(),
+    operation="copy",
+    sign=False,
+    tags=("tools",),
+    max_workers=8,
+):
+    """
+    Seeds the dataset (see the module docstring), journaling the steps
+    completed in journal_path and skipping those already journaled. Up to
+    max_workers collections are seeded at a time, their versions in order.
+    A collection stops at its first failure, the others carry on.
+
+    Returns a report with the counts of steps done and skipped, the errors
+    by collection, and the seeding throughput:
+    {"done", "skipped", "failed", "errors", "elapsed", "steps_per_second",
+     "versions_per_second"}
+    """
+    if operation not in ("copy", "move"):
+        raise ValueError(f"Unknown operation '{operation}', use copy or move.")
+    if sign or destinations:
+        hrefs = repositories.resolve_repository_hrefs(
+            client, [upload_to, *destinations]
+        )
+    journal = Journal(journal_path)
+    workdir = tempfile.mkdtemp(prefix="galaxykit-seed-")
+    lock = threading.Lock()
+    report = {"done": 0, "skipped": 0, "failed": 0, "errors": {}}
+    uploaded = 0
+    seeded = 0
+    start = time.monotonic()
+
+    def step(key, func, *args):
+        nonlocal uploaded
+        if key in journal:
+            with lock:
+                report["skipped"] += 1
+            return
+        func(*args)
+        journal.record(key)
+        with lock:
+            report["done"] += 1
+            if key.startswith("upload "):
+                uploaded += 1
+
+    def seed_namespace(namespace):
+        step(f"namespace {namespace}", namespaces.ensure_namespace, client, namespace)
+
+    def seed_collection(index_entry):
+        index, (namespace, name, versions) = index_entry
+        destination = destinations[index % len(destinations)] if destinations else None
+        for version in versions:
+            cv = f"{namespace}.{name}:{version}"
+            step(
+                f"upload {cv}",
+                _upload,
+                client,
+                namespace,
+                name,
+                version,
+                upload_to,
+                tags,
+                workdir,
+            )
+            if sign:
+                step(
+                    f"sign {cv} {upload_to}",
+                    _sign,
+                    client,
+                    namespace,
+                    name,
+                    version,
+                    upload_to,
+                    hrefs[upload_to],
+                )
+            if destination:
+                step(
+                    f"{operation} {cv} {destination}",
+                    _spread,
+                    client,
+                    namespace,
+                    name,
+                    version,
+                    upload_to,
+                    destination,
+                    operation,
+                )
+
+    def rate(count):
+        return count / max(time.monotonic() - start, 1e-6)
+
+    def finished(entry, result, error):
+        nonlocal seeded
+        seeded += 1
+        index, (namespace, name, versions) = entry
+        if error is not None:
+            report["failed"] += 1
+            report["errors"][f"{namespace}.{name}"] = str(error)
+            logger.error(f"Failed to seed {namespace}.{name}: {error}")
+        logger.info(
+            f"Seeded {seeded}/{len(data)} collections, "
+            f"{rate(uploaded):.2f} versions/s, {rate(report['done']):.2f} steps/s"
+        )
+
+    data = dataset(prefix, namespace_count, collection_count, version_count)
+    try:
+        names = sorted({namespace for namespace, _, _ in data})
+        for namespace, _, error in run_bounded(seed_namespace, names, max_workers):
+            if error is not None:
+                raise error
+        run_bounded(seed_collection, enumerate(data), max_workers, on_done=finished)
+    finally:
+        journal.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["elapsed"] = time.monotonic() - start
+    report["steps_per_second"] = rate(report["done"])
+    report["versions_per_second"] = rate(uploaded)
+    return report
@@ -0,0 +1,133 @@
+"""
+Export of a hub's configuration, `galaxykit snapshot`.
+
+Every kind is listed concurrently, page by page, and the objects are
+written out as they arrive, one per line as NDJSON or as a YAML sequence:
+
+    {"kind": "users", "object": {...}}
+
+Only a page per kind and a bounded queue of objects are held in memory at
+any time, whatever the size of the hub.
+"""
+
+import contextvars
+import logging
+import queue
+import threading
+
+import yaml
+
+from . import codec
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# container repositories live under a prefix that depends on the version
+KIND_URLS = {
+    "users": "_ui/v1/users/?limit=100",
+    "groups": "pulp/api/v3/groups/?limit=1000",
+    "roles": "pulp/api/v3/roles/?limit=1000",
+    "namespaces": "v3/namespaces/?limit=100",
+    "repositories": "pulp/api/v3/repositories/ansible/ansible/?limit=1000",
+    "remotes": "pulp/api/v3/remotes/ansible/collection/?limit=1000",
+    "distributions": "pulp/api/v3/distributions/ansible/ansible/?limit=1000",
+    "registries": "_ui/v1/execution-environments/registries/?limit=100",
+    "container_repositories": "{ee}execution-environments/repositories/?limit=100",
+}
+
+_DONE = object()
+
+
+def iter_snapshot(client, kinds=None, errors=None, queue_size=1000):
+    """
+    Yields (kind, object) for every object of the given kinds (all of
+    KIND_URLS by default), listing the kinds concurrently. Objects of
+    different kinds come interleaved.
+
+    A kind failing to list is logged and, when an `errors` dict is given,
+    recorded there by kind while the others carry on. Without it, the error
+    is raised once the other kinds are done.
+    """
+    kinds = list(kinds or KIND_URLS)
+    unknown = set(kinds) - set(KIND_URLS)
+    if unknown:
+        raise ValueError(
+            f"Unknown kinds: {', '.join(sorted(unknown))}. "
+            f"Supported kinds: {', '.join(KIND_URLS)}"
+        )
+    objects = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                objects.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(kind):
+        try:
+            url = KIND_URLS[kind].format(ee=client.ui_ee_endpoint_prefix)
+            for obj in utils.iter_results(client, url):
+                if not put((kind, obj, None)):
+                    return
+        except Exception as e:
+            put((kind, _DONE, e))
+        else:
+            put((kind, _DONE, None))
+
+    threads = [
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(produce, kind),
+            name=f"galaxykit-snapshot-{kind}",
+            daemon=True,
+        )
+        for kind in kinds
+    ]
+    for thread in threads:
+        thread.start()
+
+    first_error = None
+    try:
+        running = len(threads)
+        while running:
+            kind, obj, error = objects.get()
+            if obj is not _DONE:
+                yield kind, obj
+                continue
+            running -= 1
+            if error is not None:
+                logger.error(f"Failed to list {kind}: {error}")
+                if errors is not None:
+                    errors[kind] = str(error)
+                elif first_error is None:
+                    first_error = error
+    finally:
+        stop.set()
+    if first_error is not None:
+        raise first_error
+
+
+def write_snapshot(client, out, format="ndjson", kinds=None):
+    """
+    Writes the snapshot of the given kinds to the text stream out, as
+    "ndjson" or "yaml". Returns the number of objects written by kind and
+    the errors of the kinds that couldn't be listed:
+    {"counts": {...}, "errors": {...}}
+    """
+    if format not in ("ndjson", "yaml"):
+        raise ValueError(f"Unknown snapshot format '{format}', use ndjson or yaml.")
+    counts = dict.fromkeys(kinds or KIND_URLS, 0)
+    errors = {}
+    for kind, obj in iter_snapshot(client, kinds, errors):
+        entry = {"kind": kind, "object": obj}
+        if format == "ndjson":
+            out.write(codec.dumps(entry).decode("utf8") + "\n")
+        else:
+            out.write(yaml.safe_dump([entry], sort_keys=False))
+        counts[kind] += 1
+    out.flush()
+    return {"counts": counts, "errors": errors}
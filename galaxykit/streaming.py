@@ -0,0 +1,123 @@
+"""
+Incremental parsing of large JSON listings.
+
+Listing endpoints wrap their entries in a `data` (galaxy) or `results` (pulp)
+array. The functions here pull the entries of that array out of the response
+body as it is received, decoding one entry at a time, so memory use doesn't
+grow with the size of the listing.
+"""
+
+import re
+
+from . import codec
+
+# characters that matter outside strings, and inside them
+_STRUCTURAL = re.compile(rb'[\[\]{}",:]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+
+class _Scanner:
+    def __init__(self, keys):
+        self.keys = {key.encode("utf8") for key in keys}
+        self.buf = bytearray()
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = None
+        self.last_string = None
+        self.key = None
+        self.target_depth = None
+        self.item_start = None
+        self.finished = False
+
+    def feed(self, chunk):
+        # drop whatever was already scanned and isn't part of a pending value
+        keep = self.pos
+        if self.item_start is not None:
+            keep = self.item_start
+        elif self.in_string:
+            keep = self.string_start
+        if keep:
+            del self.buf[:keep]
+            self.pos -= keep
+            if self.item_start is not None:
+                self.item_start -= keep
+            if self.string_start is not None:
+                self.string_start -= keep
+        self.buf += chunk
+        return self.scan()
+
+    def _item(self, end):
+        raw = bytes(self.buf[self.item_start : end])
+        self.item_start = None
+        if raw.strip():
+            return [codec.loads(raw)]
+        return []
+
+    def scan(self):
+        """Scans as far as the buffer allows, returns the entries completed."""
+        items = []
+        buf = self.buf
+        while not self.finished:
+            if self.in_string:
+                m = _STRING_SPECIAL.search(buf, self.pos)
+                if m is None:
+                    self.pos = len(buf)
+                    break
+                if m.group() == b"\\":
+                    if m.end() >= len(buf):
+                        # the escaped character is in the next chunk
+                        self.pos = m.start()
+                        break
+                    self.pos = m.end() + 1
+                    continue
+                self.in_string = False
+                self.pos = m.end()
+                if self.depth == 1 and self.target_depth is None:
+                    self.last_string = bytes(buf[self.string_start + 1 : m.start()])
+                self.string_start = None
+                continue
+
+            m = _STRUCTURAL.search(buf, self.pos)
+            if m is None:
+                self.pos = len(buf)
+                break
+            char = m.group()
+            self.pos = m.end()
+            if char == b'"':
+                self.in_string = True
+                self.string_start = m.start()
+            elif char in (b"{", b"["):
+                self.depth += 1
+                if char == b"[" and self.target_depth is None:
+                    # either the listing array, or a bare top level array
+                    if self.depth == 1 or (self.depth == 2 and self.key in self.keys):
+                        self.target_depth = self.depth
+                        self.item_start = self.pos
+            elif char in (b"}", b"]"):
+                if self.depth == self.target_depth:
+                    items.extend(self._item(m.start()))
+                    self.finished = True
+                self.depth -= 1
+            elif char == b",":
+                if self.depth == self.target_depth:
+                    items.extend(self._item(m.start()))
+                    self.item_start = self.pos
+                elif self.depth == 1:
+                    self.key = None
+            elif char == b":" and self.depth == 1:
+                self.key = self.last_string
+        return items
+
+
+def iter_array_items(chunks, keys=("data", "results")):
+    """
+    Yields the entries of the first array found under one of `keys` in the
+    top level object (or of the top level array itself) of the JSON document
+    given as an iterable of byte chunks. Reading stops once that array ends.
+    """
+    scanner = _Scanner(keys)
+    for chunk in chunks:
+        yield from scanner.feed(chunk)
+        if scanner.finished:
+            return
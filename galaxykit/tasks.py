@@ -1,14 +1,29 @@
-from time import sleep
 from .constants import SLEEP_SECONDS_POLLING
 from .constants import POLLING_MAX_ATTEMPTS
+from .models import Task
+from .utils import iter_results, project_fields, sleep_within_deadline
 
 
-def get_tasks(client, only_running=False):
+def _tasks_url(only_running):
     tasks_url = f"pulp/api/v3/tasks/?ordering=-pulp_created"
     if only_running:
         tasks_url += f"&state__in=waiting,running"
+    return tasks_url
 
-    return client.get(tasks_url)
+
+def get_tasks(client, only_running=False):
+    return client.get(_tasks_url(only_running))
+
+
+def iter_tasks(client, only_running=False, records=False):
+    """
+    Yields every task, newest first, as models.Task records with records=True.
+    """
+    tasks_url = _tasks_url(only_running) + "&limit=100"
+    if not records:
+        return iter_results(client, tasks_url)
+    tasks_url = project_fields(tasks_url, Task.api_fields())
+    return iter_results(client, tasks_url, Task)
 
 
 def get_task(client, task_id):
@@ -30,7 +45,7 @@ def wait_task(client, task_id, sleep_seconds=None, max_attempts=None):
             if max_attempts == 0:
                 break
 
-        sleep(sleep_seconds)
+        sleep_within_deadline(sleep_seconds, f"waiting for task {task_id}")
         task = get_task(client, task_id)
 
     if task["state"] != "completed":
@@ -53,5 +68,5 @@ def wait_all(client, sleep_seconds=None, max_attempts=10):
             if max_attempts == 0:
                 break
 
-        sleep(sleep_seconds)
+        sleep_within_deadline(sleep_seconds, "waiting for running tasks")
         tasks = get_tasks(client, only_running=True)
@@ -4,6 +4,12 @@ Functions for creating, updating, and deleting users.
 
 import json
 
+from . import groups
+from . import models
+from . import utils
+from .concurrency import run_bounded
+from .utils import GalaxyClientError
+
 
 def get_or_create_user(
     client, username, password, group, fname="", lname="", email="", superuser=False
@@ -18,9 +24,11 @@ def get_or_create_user(
         "name": group_name,
         "pulp_href": f"/pulp/api/v3/groups/{group_id}",
     }
+
+    Returns a "created" flag and the user.
     """
     # check if the user already exists
-    user_url = f"_ui/v1/users/?username={username}"
+    user_url = utils.merge_query("_ui/v1/users/", username=username, limit=1)
     user_resp = client.get(user_url)
     if user_resp["meta"]["count"] == 0:
         return True, create_user(
@@ -30,6 +38,22 @@ def get_or_create_user(
     return False, user_resp["data"][0]
 
 
+def ensure_user(
+    client, username, password, group, fname="", lname="", email="", superuser=False
+):
+    """
+    Creates the user unless it already exists, see get_or_create_user. Unlike
+    it, tries creating first, saving the lookup for new users.
+    Returns a "created" flag and the user.
+    """
+    return utils.ensure(
+        lambda: create_user(
+            client, username, password, group, fname, lname, email, superuser
+        ),
+        lambda: get_user(client, username),
+    )
+
+
 def create_user(
     client, username, password, group, fname="", lname="", email="", superuser=False
 ):
@@ -99,6 +123,15 @@ def get_user(client, username):
     return user_resp["data"][0]
 
 
+def resolve_users(client, usernames, fields=None):
+    """
+    Returns the users with the given usernames, keyed by username. The users
+    come from pulp/api/v3/users/, their ids are the ones used by _ui/v1 too.
+    """
+    url = "pulp/api/v3/users/"
+    return utils.resolve_in(client, url, "username__in", usernames, "username", fields)
+
+
 def get_user_list(client):
     """
     Returns list of usernames of users in the system
@@ -106,9 +139,112 @@ def get_user_list(client):
     return client.get("_ui/v1/users/")
 
 
+def iter_users(client, records=False):
+    """
+    Yields every user in the system, as models.User records with records=True.
+    """
+    url = "_ui/v1/users/?limit=100"
+    return utils.iter_results(client, url, models.User if records else None)
+
+
 def update_me(client, data):
     return client.put(f"_ui/v1/me/", data)
 
 
 def get_me(client):
     return client.get(f"_ui/v1/me/")
+
+
+def provision_users(client, users, max_workers=8):
+    """
+    Creates the users that don't exist yet and adds them all to their
+    groups. `users` is an iterable of dicts with a "username" and a
+    "password", and optionally "first_name", "last_name", "email",
+    "is_superuser" and "groups", a list of group names.
+
+    The existing users and their groups are listed in one paginated sweep
+    and the groups resolved in one batch. Only the missing users are
+    created, and only the missing memberships added, concurrently.
+
+    Returns a report: {"created", "existing", "failed", "memberships_added",
+    "errors"}, all counts but "errors", listing {"username", "error"} and
+    also "group" for memberships that couldn't be added.
+    """
+    users = list({user["username"]: user for user in users}.values())
+    url = "pulp/api/v3/users/?limit=1000&fields=username,groups"
+    existing = {
+        user["username"]: {group["name"] for group in user["groups"]}
+        for user in utils.iter_results(client, url)
+    }
+    group_names = {name for user in users for name in user.get("groups") or ()}
+    group_ids = {
+        name: group["id"]
+        for name, group in groups.resolve_groups(
+            client, group_names, fields=["id"]
+        ).items()
+    }
+    missing = [user for user in users if user["username"] not in existing]
+    report = {
+        "created": 0,
+        "existing": len(users) - len(missing),
+        "failed": 0,
+        "memberships_added": 0,
+        "errors": [],
+    }
+
+    def create(user):
+        return create_user(
+            client,
+            user["username"],
+            user["password"],
+            None,
+            user.get("first_name", ""),
+            user.get("last_name", ""),
+            user.get("email", ""),
+            user.get("is_superuser", False),
+        )
+
+    failed = set()
+    for user, _, error in run_bounded(create, missing, max_workers):
+        if error is None:
+            report["created"] += 1
+        elif isinstance(error, GalaxyClientError) and utils.is_conflict(error):
+            report["existing"] += 1
+        else:
+            report["failed"] += 1
+            failed.add(user["username"])
+            report["errors"].append({"username": user["username"], "error": str(error)})
+
+    memberships = []
+    for user in users:
+        username = user["username"]
+        if username in failed:
+            continue
+        for name in user.get("groups") or ():
+            if name in existing.get(username, ()):
+                continue
+            if name not in group_ids:
+                report["errors"].append(
+                    {
+                        "username": username,
+                        "group": name,
+                        "error": f"No group '{name}' found.",
+                    }
+                )
+            else:
+                memberships.append((username, name))
+
+    def add_membership(membership):
+        username, name = membership
+        return groups.add_user_to_group(client, username, group_ids[name])
+
+    for (username, name), _, error in run_bounded(
+        add_membership, memberships, max_workers
+    ):
+        if error is None:
+            report["memberships_added"] += 1
+        else:
+            report["errors"].append(
+                {"username": username, "group": name, "error": str(error)}
+            )
+    return report
@@ -1,14 +1,17 @@
 """Utility functions"""
 
+import contextvars
 import logging
 import re
 import time
-from urllib.parse import urljoin
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, quote, urlencode, urljoin, urlsplit, urlunsplit
 
 import requests
-from simplejson.errors import JSONDecodeError
 
-from .constants import SLEEP_SECONDS_POLLING
+from . import codec
+from .concurrency import iter_prefetched
+from .constants import FINAL_POLL_SECONDS, MAX_FILTER_LENGTH, SLEEP_SECONDS_POLLING
 
 
 logger = logging.getLogger(__name__)
@@ -18,6 +21,12 @@ class TaskWaitingTimeout(Exception):
     pass
 
 
+class DeadlineExceeded(TaskWaitingTimeout):
+    def __init__(self, message="Deadline exceeded."):
+        self.message = message
+        super().__init__(message)
+
+
 class TaskFailed(Exception):
     def __init__(self, message):
         self.message = message
@@ -29,7 +38,7 @@ class GalaxyClientError(Exception):
 
     @property
     def status_code(self):
-        if self.response:
+        if self.response is not None:
             return self.response.status_code
         else:
             return None
@@ -43,14 +52,94 @@ class GalaxyClientError(Exception):
             self.response = kwargs.pop("response")
         if "json" in kwargs:
             self.json = kwargs.pop("json")
-        elif self.response:
+        elif self.response is not None:
             try:
-                self.json = self.response.json()
-            except JSONDecodeError:
+                self.json = codec.loads(self.response.content)
+            except codec.DecodeError:
                 pass
         super().__init__(*args[skip:], **kwargs)
 
 
+_deadline = contextvars.ContextVar("galaxykit_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Bounds the total time spent by all the galaxykit calls made in the block,
+    request timeouts included. Once the time is up, requests and task waiters
+    raise DeadlineExceeded. Nested deadlines can only shorten the outer one.
+    Task waiters poll one last time FINAL_POLL_SECONDS before the deadline
+    rather than sleeping past it.
+
+    with deadline(120):
+        namespaces.delete_namespace(client, "ns", cascade=True)
+
+    The deadline is carried by a context variable, so it isn't inherited by
+    threads started from the block.
+    """
+    expires = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        expires = min(expires, outer)
+    token = _deadline.set(expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining():
+    """Returns the seconds left before the current deadline, None without one."""
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check_deadline(what=None):
+    """Raises DeadlineExceeded if the current deadline has passed."""
+    remaining = time_remaining()
+    if remaining is not None and remaining <= 0:
+        if what:
+            raise DeadlineExceeded(f"Deadline exceeded: {what}")
+        raise DeadlineExceeded()
+    return remaining
+
+
+def request_timeout(timeout, what=None):
+    """
+    Returns the `requests` timeout to use for a request, shortened so it
+    can't outlast the current deadline.
+    """
+    remaining = check_deadline(what)
+    if remaining is None:
+        return timeout
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+
+def sleep_within_deadline(seconds, what=None):
+    """
+    time.sleep that doesn't outlive a deadline. When the deadline comes
+    first, only sleeps until FINAL_POLL_SECONDS before it, leaving the caller
+    time to poll once more, and raises DeadlineExceeded once that time has
+    been used.
+    """
+    remaining = check_deadline(what)
+    if remaining is None or remaining - FINAL_POLL_SECONDS >= seconds:
+        time.sleep(seconds)
+        return
+    if remaining <= FINAL_POLL_SECONDS:
+        if what:
+            raise DeadlineExceeded(f"Deadline exceeded: {what}")
+        raise DeadlineExceeded()
+    time.sleep(remaining - FINAL_POLL_SECONDS)
+
+
 def wait_for_task(
     api_client, resp, task_id=None, timeout=300, raise_on_error=False, version="v3"
 ):
@@ -64,6 +153,7 @@ def wait_for_task(
     while not ready:
         if wait_until < time.time():
             raise TaskWaitingTimeout()
+        check_deadline(f"waiting for task {url}")
         try:
             resp = api_client.get(url)
             if version == "v1":
@@ -85,10 +175,201 @@ def wait_for_task(
             else:
                 ready = resp["state"] not in ("running", "waiting")
 
-        time.sleep(SLEEP_SECONDS_POLLING)
+        if not ready:
+            sleep_within_deadline(SLEEP_SECONDS_POLLING, f"waiting for task {url}")
     return resp
 
 
+def merge_query(url, **params):
+    """
+    Returns url with params added to its query string, replacing any values
+    already there for the same keys. Values are URL encoded, lists and tuples
+    are sent comma separated, and None values are left out.
+
+    merge_query("pulp/api/v3/roles/", name=name, fields=["pulp_href"], limit=1)
+    """
+    parts = urlsplit(url)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in params
+    ]
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        query.append((key, value))
+    return urlunsplit(parts._replace(query=urlencode(query, safe=",/")))
+
+
+def project_fields(url, fields=None, exclude_fields=None):
+    """
+    Adds pulp's field projection to url, so only `fields` (or everything
+    but `exclude_fields`) are serialized in the response.
+    """
+    if not fields and not exclude_fields:
+        return url
+    return merge_query(
+        url, fields=fields or None, exclude_fields=exclude_fields or None
+    )
+
+
+def chunk_filter_values(values, max_length=MAX_FILTER_LENGTH):
+    """
+    Splits values into lists that each fit in a comma separated, URL encoded
+    filter (`name__in=a,b,c`) of at most max_length characters.
+    """
+    chunk, length = [], 0
+    for value in values:
+        size = len(quote(str(value), safe="/")) + 1
+        if chunk and length + size > max_length:
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(value)
+        length += size
+    if chunk:
+        yield chunk
+
+
+def resolve_in(client, url, filter_name, values, key, fields=None):
+    """
+    Fetches the objects of the listing at url whose `key` is one of values,
+    using an `__in` filter (`filter_name`, e.g. "name__in") in as few
+    requests as the URL length allows. Returns a dict of the objects found
+    keyed by their `key`; values not found are missing from it.
+
+    resolve_in(client, "pulp/api/v3/roles/", "name__in", names, "name")
+    """
+    if fields:
+        fields = list(dict.fromkeys([key, *fields]))
+    found = {}
+    for chunk in chunk_filter_values(dict.fromkeys(values)):
+        chunk_url = merge_query(url, **{filter_name: chunk, "limit": len(chunk)})
+        for obj in iter_results(client, project_fields(chunk_url, fields)):
+            found[obj[key]] = obj
+    return found
+
+
+def hydrate_hrefs(client, url, hrefs, fields=None):
+    """
+    Fetches the pulp objects with the given hrefs from the listing at url,
+    returning them keyed by pulp_href.
+    """
+    return resolve_in(client, url, "pulp_href__in", hrefs, "pulp_href", fields)
+
+
+def is_conflict(error):
+    """
+    Tells whether a GalaxyClientError means the object being created already
+    exists: a 409, or a 400 complaining about a unique field.
+    """
+    if error.status_code == 409:
+        return True
+    if error.status_code != 400:
+        return False
+    details = str(error.json if error.json is not None else error.args).lower()
+    return "unique" in details or "already exists" in details
+
+
+def ensure(create, get):
+    """
+    Calls create and returns (True, its result). If the object turns out to
+    exist already, returns (False, get()) instead. Creating first saves the
+    lookup whenever the object is new.
+
+    A 403 is taken as a possible conflict too, for callers allowed to read
+    but not to create: the object is looked up, and the 403 raised if it
+    can't be found.
+    """
+    try:
+        return True, create()
+    except GalaxyClientError as e:
+        if e.status_code == 403:
+            try:
+                return False, get()
+            except Exception:
+                raise e
+        if not is_conflict(e):
+            raise
+    return False, get()
+
+
+def created_resources(api_client, task, hydrate=False):
+    """
+    Returns the hrefs of the objects created by a finished pulp task or, with
+    hydrate=True, the objects themselves. Objects of the same kind are read
+    together with a pulp_href__in filter, so hydrating takes one request per
+    kind of object created.
+    """
+    hrefs = task.get("created_resources") or []
+    if not hydrate:
+        return hrefs
+    by_listing = {}
+    for href in hrefs:
+        listing = href.rstrip("/").rsplit("/", 1)[0] + "/"
+        by_listing.setdefault(listing, []).append(href)
+    objects = {}
+    for listing, group in by_listing.items():
+        if len(group) == 1:
+            objects[group[0]] = api_client.get(group[0])
+        else:
+            objects.update(hydrate_hrefs(api_client, listing, group))
+    return [objects.get(href) for href in hrefs]
+
+
+def wait_for_created(api_client, resp, hydrate=False, timeout=300):
+    """
+    Waits for the task started by resp and returns what it created, as
+    returned by created_resources. Raises TaskFailed if the task fails.
+    """
+    task = wait_for_task(api_client, resp, timeout=timeout, raise_on_error=True)
+    return created_resources(api_client, task, hydrate)
+
+
+def wait_for_tasks(
+    api_client, task_hrefs, timeout=300, raise_on_error=False, on_finished=None
+):
+    """
+    Waits for several pulp tasks at once, polling them all with a single
+    pulp_href__in listing per round instead of one request per task.
+    `on_finished(task)` is called as each task ends. Returns the finished
+    tasks keyed by href.
+    """
+    pending = set(task_hrefs)
+    finished = {}
+    wait_until = time.time() + timeout
+    while pending:
+        check_deadline(f"waiting for {len(pending)} tasks")
+        tasks = resolve_in(
+            api_client,
+            "pulp/api/v3/tasks/",
+            "pulp_href__in",
+            pending,
+            "pulp_href",
+            fields=["name", "state", "error", "created_resources"],
+        )
+        for href, task in tasks.items():
+            if task["state"] in ("waiting", "running", "canceling"):
+                continue
+            pending.discard(href)
+            finished[href] = task
+            if task["state"] == "failed":
+                logger.error(task["error"])
+                if raise_on_error:
+                    raise TaskFailed(task["error"])
+            if on_finished is not None:
+                on_finished(task)
+        if not pending:
+            break
+        if wait_until < time.time():
+            raise TaskWaitingTimeout()
+        sleep_within_deadline(
+            SLEEP_SECONDS_POLLING, f"waiting for {len(pending)} tasks"
+        )
+    return finished
+
+
 def pulp_href_to_id(href):
     uuid_regex = "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
 
@@ -99,6 +380,53 @@ def pulp_href_to_id(href):
     return None
 
 
+def _page(page):
+    """Returns the entries, the next link and the count of a listing page."""
+    if "data" in page:
+        return page["data"], page["links"]["next"], page.get("meta", {}).get("count")
+    return page["results"], page["next"], page.get("count")
+
+
+def iter_results(client, url, record=None, prefetch=0):
+    """
+    Yields the entries of a paginated listing page by page, following the
+    `links.next` (galaxy) or `next` (pulp) links. With a `record` class from
+    galaxykit.models, entries are yielded as compact records instead of dicts.
+
+    With prefetch, the pages following the first one are requested by their
+    offset, up to `prefetch` of them at a time ahead of the one being read.
+    """
+    if prefetch:
+        yield from _iter_prefetched_results(client, url, record, prefetch)
+        return
+    while url:
+        entries, url, _ = _page(client.get(url))
+        for entry in entries:
+            yield entry if record is None else record.from_dict(entry)
+
+
+def _iter_prefetched_results(client, url, record, prefetch):
+    query = dict(parse_qsl(urlsplit(url).query))
+    entries, next_url, count = _page(client.get(url))
+    limit = int(query.get("limit") or len(entries))
+    for entry in entries:
+        yield entry if record is None else record.from_dict(entry)
+    if not next_url:
+        return
+    if not limit or count is None:
+        # the offsets can't be worked out, follow the links instead
+        yield from iter_results(client, next_url, record)
+        return
+
+    def get_page(offset):
+        return _page(client.get(merge_query(url, offset=offset, limit=limit)))[0]
+
+    start = int(query.get("offset") or 0) + limit
+    for entries in iter_prefetched(get_page, range(start, count, limit), prefetch):
+        for entry in entries:
+            yield entry if record is None else record.from_dict(entry)
+
+
 def wait_for_url(client, url, timeout_sec=6000):
     """Wait until url stops returning a 404."""
     ready = False
@@ -112,7 +440,7 @@ def wait_for_url(client, url, timeout_sec=6000):
         except GalaxyClientError as e:
             if "404" not in str(e):
                 raise
-            time.sleep(SLEEP_SECONDS_POLLING)
+            sleep_within_deadline(SLEEP_SECONDS_POLLING, f"waiting for {url}")
         else:
             ready = True
     return res